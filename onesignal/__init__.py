@@ -20,4 +20,4 @@ python-onesignal is a Python wrapper for the OneSignal REST API.
 __version__ = '0.1.0'
 
 from .api import OneSignal
-from .exceptions import OneSignalApiError
+from .exceptions import OneSignalApiError, OneSignalRateLimitError, OneSignalValidationError
@@ -8,32 +8,73 @@ This module contains functionality for access to OneSignal API calls.
 """
 
 import json
+import logging
+import uuid
 
 import requests
 
-from .exceptions import OneSignalApiError
+from .compression import gzip_compress
+from .exceptions import OneSignalApiError, OneSignalRateLimitError, OneSignalValidationError
+from .instrumentation import endpoint_template
+from .validators import validate
+
+log = logging.getLogger(__name__)
+
+
+def _is_uuid4(value):
+    try:
+        return uuid.UUID(value).version == 4
+    except (AttributeError, TypeError, ValueError):
+        return False
 
 
 class OneSignal(object):
-    def __init__(self, api_key, app_id=None, api_version='v1'):
+    def __init__(self, api_key, app_id=None, api_version='v1', api_base='https://onesignal.com/api',
+                 instrumentation=None, compress_threshold=None, compress_level=6, dedupe_index=None,
+                 validate_payloads=True, rate_limiter=None, hedge_policy=None):
         """A OneSignal API wrapper instance.
 
         :param api_key: Your application api key or user api key.
         :param app_id: (optional) Your application id.
         :param api_version: (optional) The API version, defaults to "v1".
+        :param api_base: (optional) The API root, defaults to "https://onesignal.com/api".
+            Point this at a local emulator (see ``onesignal.emulator``) for load tests.
+        :param instrumentation: (optional) An :class:`onesignal.instrumentation.Instrumentation`
+            whose hooks are called around every request.
+        :param compress_threshold: (optional) Gzip request bodies of at least this many bytes
+            and send them with ``Content-Encoding: gzip``. Off by default.
+        :param compress_level: (optional) zlib level used for request bodies, defaults to 6.
+        :param dedupe_index: (optional) A :class:`onesignal.dedupe.LRUKeyIndex` of idempotency
+            keys already sent successfully; ``notifications_create`` skips keys found in it.
+        :param validate_payloads: (optional) Check payloads against ``onesignal.validators``
+            before sending, raising :class:`onesignal.OneSignalValidationError`. Defaults to True.
+        :param rate_limiter: (optional) A :class:`onesignal.ratelimit.SharedRateLimiter` every
+            request waits on before it is sent, shared with the other processes on the host.
+        :param hedge_policy: (optional) A :class:`onesignal.hedging.HedgePolicy`; slow GET
+            requests are then sent a second time on another connection and the first
+            response wins. Off by default.
 
         """
         self.api_key = api_key
         self.app_id = app_id
 
-        self.api_base = 'https://onesignal.com/api/{}'
+        self.api_base = api_base.rstrip('/')
         self.api_version = api_version
-        self.api_url = self.api_base.format(api_version)
+        self.api_url = '{}/{}'.format(self.api_base, api_version)
+
+        self.instrumentation = instrumentation
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.dedupe_index = dedupe_index
+        self.validate_payloads = validate_payloads
+        self.rate_limiter = rate_limiter
+        self.hedge_policy = hedge_policy
 
         self.client = requests.Session()
         self.client.headers = {
             'Content-Type': 'application/json; charset=utf-8',
             "Authorization": "Basic {}".format(self.api_key),
+            'Accept-Encoding': 'gzip, deflate',
         }
 
     def __repr__(self):
@@ -48,11 +89,52 @@ class OneSignal(object):
 
         :rtype: dict
         """
+        return self._request(method, self._url(url), **data)
+
+    def send_encoded(self, method, url, body, content_encoding=None, payload_size=None,
+                     session=None):
+        """Send a body that was already serialized to JSON, i.e. by ``onesignal.campaign`` workers.
+
+        :param method: POST or PUT.
+        :param url: Either a full OneSignal REST API url or a portion (i.e. "notifications").
+        :param body: The JSON body as bytes, including ``app_id``.
+        :param content_encoding: (optional) ``gzip`` when ``body`` is gzipped.
+        :param payload_size: (optional) Size of ``body`` before compression, for instrumentation.
+        :param session: (optional) A :class:`requests.Session` to send with instead of ``client``.
+
+        :rtype: dict
+        """
+        method = method.lower()
+        url = self._url(url)
+
+        event = None
+        if self.instrumentation is not None:
+            event = self.instrumentation.start(method, url, self.api_url)
+
+        response_kwargs = {'data': body}
+        if content_encoding is not None:
+            response_kwargs['headers'] = {'Content-Encoding': content_encoding}
+
+        return self._send(method, url, event, payload_size or len(body), len(body),
+                          session=session, **response_kwargs)
+
+    def _validate(self, endpoint, data):
+        if not self.validate_payloads:
+            return data
+
+        return validate(endpoint, data)
+
+    def _endpoint(self, url):
+        path = url[len(self.api_url):] if url.startswith(self.api_url) else url
+
+        return endpoint_template(path)
+
+    def _url(self, url):
         # if the url doesn't start with a protocol, join the "url" and self.api_url
-        if not url.startswith('https://'):
+        if not url.startswith(('https://', 'http://')):
             url = '%s/%s' % (self.api_url, url)
 
-        return self._request(method, url, **data)
+        return url
 
     def get(self, url, **data):
         """Shortcut to make a GET request to OneSignal's REST API.
@@ -114,24 +196,112 @@ class OneSignal(object):
 
         method = method.lower()
 
+        instrumentation = self.instrumentation
+        event = None
+        if instrumentation is not None:
+            event = instrumentation.start(method, url, self.api_url)
+
         response_kwargs = {}
+        payload_size = wire_size = 0
 
         if method != 'get':
-            response_kwargs['data'] = json.dumps(payload)
+            body = json.dumps(payload)
+            payload_size = wire_size = len(body)
+
+            # json.dumps escapes non-ascii, so the body is its own byte length
+            if self.compress_threshold is not None and payload_size >= self.compress_threshold:
+                body = gzip_compress(body.encode('utf-8'), self.compress_level)
+                wire_size = len(body)
+                response_kwargs['headers'] = {'Content-Encoding': 'gzip'}
+
+            response_kwargs['data'] = body
         else:
             response_kwargs['params'] = payload
 
-        print 'resposne_kwargs', response_kwargs
+        return self._send(method, url, event, payload_size, wire_size, **response_kwargs)
+
+    def _send(self, method, url, event, payload_size, wire_size, session=None, **response_kwargs):
+        """Internal method to send a serialized request and decode its response.
+
+        :param method: get, post, delete or put.
+        :param url: A full OneSignal REST API url.
+        :param event: The :class:`onesignal.instrumentation.RequestEvent` of this request, or None.
+        :param payload_size: Size of the serialized body.
+        :param wire_size: Size of the body as sent, after any compression.
+        :param session: (optional) Sends with this :class:`requests.Session` instead of ``client``.
+        :param \*\*response_kwargs: Passed on to :class:`requests.Session`.
+
+        :rtype: dict
+        """
+        instrumentation = self.instrumentation
+
+        rate_limiter = self.rate_limiter
+        hedge_policy = self.hedge_policy
+        endpoint = None
+        if rate_limiter is not None or hedge_policy is not None:
+            endpoint = event.endpoint if event is not None else self._endpoint(url)
+
+        if rate_limiter is not None:
+            try:
+                waited = rate_limiter.acquire(endpoint)
+            except OneSignalRateLimitError as e:
+                if event is not None:
+                    instrumentation.failed(event, e)
+                raise
+            if event is not None and waited:
+                instrumentation.throttled(event, waited)
+
+        if event is not None:
+            instrumentation.sending(event, payload_size, wire_size)
 
-        func = getattr(self.client, method)
+        log.debug('Request %s %s: %s', method.upper(), url, response_kwargs)
 
-        response = func(url, **response_kwargs)
+        func = getattr(session or self.client, method)
 
         try:
-            print 'resposne.text', response.text
+            if hedge_policy is not None and hedge_policy.applies(method, endpoint):
+                response, hedged, won = hedge_policy.send(func, url, endpoint,
+                                                          rate_limiter=rate_limiter,
+                                                          **response_kwargs)
+                if event is not None and hedged:
+                    event.extra['hedged'] = True
+                    event.extra['hedge_won'] = won
+            else:
+                response = func(url, **response_kwargs)
+        except requests.RequestException as e:
+            if event is not None:
+                instrumentation.failed(event, e)
+            raise
+
+        if event is not None:
+            instrumentation.received(event, response)
+
+        try:
+            content = self._decode(response)
+        except OneSignalApiError as e:
+            if event is not None:
+                instrumentation.failed(event, e)
+            raise
+
+        if event is not None:
+            instrumentation.finished(event)
+
+        return content
+
+    def _decode(self, response):
+        """Internal method to decode a OneSignal REST API response.
+
+        :param response: A :class:`requests.Response`.
+
+        :rtype: dict
+        """
+        try:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Response %s: %s', response.status_code, response.text)
             content = response.json()
         except ValueError:
-            raise OneSignalApiError('There was an error decoding the response, it was not JSON.')
+            raise OneSignalApiError('There was an error decoding the response, it was not JSON.',
+                                    status_code=response.status_code)
 
         if response.status_code == 200:
             pass
@@ -139,13 +309,13 @@ class OneSignal(object):
             try:
                 message = content.get('errors')
                 if isinstance(message, dict):
-                    message = message[message.keys()[0]]
+                    message = next(iter(message.values()))
                 elif isinstance(message, list):
                     message = message[0]
-            except IndexError:
+            except (IndexError, StopIteration):
                 message = 'OneSignal returned an error that could not be parsed: {}'.format(response.text)
 
-            raise OneSignalApiError(message)
+            raise OneSignalApiError(message, status_code=response.status_code)
 
         return content
 
@@ -169,9 +339,18 @@ class OneSignal(object):
         """
         return self.put('notifications/{}'.format(notification_id))
 
-    def notifications_create(self, **data):
+    def notifications_create(self, idempotency_key=None, **data):
         """Sends notifications to your users.
 
+        :param idempotency_key: (optional) A UUID v4 string sent as ``external_id``. OneSignal will
+            not send a notification twice for the same key within 30 days, so reuse it when retrying
+            a send that failed or timed out. Defaults to ``external_id`` when that is passed,
+            otherwise one is generated.
+
+        When the client has a ``dedupe_index`` (:class:`onesignal.dedupe.LRUKeyIndex`) and
+        already sent ``idempotency_key`` successfully, no request is made and
+        ``{'id': ..., 'external_id': ..., 'duplicate': True}`` is returned.
+
         Docs: https://documentation.onesignal.com/reference#create-notification
 
         :rtype: dict
@@ -187,7 +366,36 @@ class OneSignal(object):
           >>> {u'id': u'732d69c7-2599-489c-89a6-55cf6b41defe', u'recipients': 1}
 
         """
-        return self.post('notifications', **data)
+        external_id = data.get('external_id')
+        if idempotency_key and external_id and idempotency_key != external_id:
+            raise OneSignalValidationError('idempotency_key and external_id differ.')
+
+        idempotency_key = idempotency_key or external_id or str(uuid.uuid4())
+        if not _is_uuid4(idempotency_key):
+            raise OneSignalValidationError(
+                'idempotency_key must be a UUID v4, got {!r}.'.format(idempotency_key))
+
+        index = self.dedupe_index
+
+        if index is not None and idempotency_key in index:
+            return {
+                'id': index.notification_id(idempotency_key),
+                'external_id': idempotency_key,
+                'duplicate': True,
+            }
+
+        data.update({
+            'external_id': idempotency_key,
+        })
+        data = self._validate('notifications_create', data)
+
+        content = self.post('notifications', **data)
+
+        # only successful sends are recorded, a failed or timed out one may be retried
+        if index is not None:
+            index.add(idempotency_key, content.get('id'))
+
+        return content
 
     def notifications_cancel(self, notification_id):
         """Sends notifications to your users.
@@ -373,6 +581,7 @@ class OneSignal(object):
         data.update({
             'name': name,
         })
+        data = self._validate('apps_create', data)
 
         return self.post('apps', **data)
 
@@ -495,7 +704,8 @@ class OneSignal(object):
     def devices_create(self, device_type, **data):
         """Register a new device to one of your OneSignal apps.
 
-        :param device_type: An integer representing a device platform from the docs.
+        :param device_type: An integer representing a device platform from the docs, or its
+            name from ``onesignal.validators.DEVICE_TYPES`` (i.e. "ios", "android").
 
         Docs: https://documentation.onesignal.com/reference#add-a-device
 
@@ -523,12 +733,10 @@ class OneSignal(object):
                 "badge_count": 0
             }
         """
-        # TODO: maybe make this easier by mapping their ints to words
-        # So a user could run: onesignal.devices_create('ios', **data)
-        try:
-            device_type = int(device_type)
-        except ValueError:
-            raise OneSignalApiError('device_type must be an integer.')
+        data.update({
+            'device_type': device_type,
+        })
+        data = self._validate('devices_create', data)
 
         return self.post('players', **data)
 
@@ -546,6 +754,8 @@ class OneSignal(object):
           >>> onesignal.devices_update('a8c50012-7a78-492a-8a34-6bd3aa2e5f87', lang='es')
           >>> {'success': true}
         """
+        data = self._validate('devices_update', data)
+
         return self.put('players/{}'.format(player_id), **data)
 
     def sessions_create(self, player_id, **data):
@@ -562,6 +772,8 @@ class OneSignal(object):
           >>> onesignal.sessions_create('a8c50012-7a78-492a-8a34-6bd3aa2e5f87')
           >>> {'success': true}
         """
+        data = self._validate('sessions_create', data)
+
         return self.post('players/{}/on_session'.format(player_id), **data)
 
     def purchases_create(self, player_id, purchases=None, **data):
@@ -582,17 +794,10 @@ class OneSignal(object):
         purchases = purchases or []
         data = data or {}
 
-        for purchase in purchases:
-            sku = purchase.get('sku')
-            amount = purchase.get('amount')
-            iso = purchase.get('iso')
-
-            if not sku or not amount or not iso:
-                raise OneSignalApiError('A purchase is missing a required field: {}'.format(json.dumps(purchase)))
-
         data.update({
             'purchases': purchases,
         })
+        data = self._validate('purchases_create', data)
 
         return self.post('players/{}/on_purchase'.format(player_id), **data)
 
@@ -614,6 +819,7 @@ class OneSignal(object):
             'state': 'ping',
             'active_time': active_time,
         }
+        data = self._validate('sessions_length_update', data)
 
         return self.post('players/{}/on_focus'.format(player_id), **data)
 
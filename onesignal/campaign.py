@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.campaign
+~~~~~~~~~~~~~~~~~
+
+This module contains a pipeline for large personalized campaigns.
+
+Building ``notifications_create`` bodies (localized contents, per-user data,
+chunking, JSON encoding, compression) is CPU bound, so it runs in a process
+pool. Recipients are packed as 16-byte UUIDs into one shared memory array
+that workers slice by index, rather than being pickled to every task. The
+encoded bodies come back to the parent, where threads send them over a pool
+of keep-alive connections.
+
+Usage::
+
+  >>> def build(player_ids, context):
+  ...     return {'include_player_ids': player_ids, 'contents': context['contents']}
+  >>> campaign = Campaign(onesignal, build, processes=8, connections=16)
+  >>> campaign.run(player_ids, context={'contents': {'en': 'Hi'}})
+  {'chunks': 500, 'payloads': 500, 'sent': 500, 'skipped': 0, 'failed': 0, ...}
+
+``build`` is called in the worker processes, so it must be a module level
+function. It returns the notification fields for a chunk of player ids, or a
+list of them (i.e. one per language); ``include_player_ids`` defaults to the
+chunk. Payloads are validated in the workers when the client validates, so an
+invalid one is reported without being sent. ``sent``, ``skipped``, ``invalid``
+and ``failed`` count payloads.
+"""
+
+import ctypes
+import hashlib
+import json
+import multiprocessing
+import threading
+import uuid
+from collections import deque
+from multiprocessing.sharedctypes import RawArray
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .compat import Queue
+from .compression import gzip_compress
+from .exceptions import OneSignalApiError, OneSignalValidationError
+from .recipients import PLAYER_ID_SIZE, RecipientSet, pack_player_id
+from .validators import MAX_PLAYER_IDS, VALIDATORS
+
+
+def chunk_key(campaign_id, index):
+    """The idempotency key of chunk ``index``, the same every time a campaign is run.
+
+    It is derived from ``campaign_id`` and formatted as a UUID v4, which is what
+    OneSignal expects in ``external_id``.
+    """
+    digest = hashlib.md5('{}:{}'.format(campaign_id, index).encode('utf-8')).digest()
+
+    return str(uuid.UUID(bytes=digest, version=4))
+
+
+def default_build(player_ids, context):
+    """Send ``context`` as-is to every chunk."""
+    return dict(context or {})
+
+
+# set in each worker by _init_worker, so tasks only carry index ranges
+_worker = {}
+
+
+def _init_worker(recipients, build, context, options):
+    _worker.update(recipients=recipients, build=build, context=context, options=options)
+
+
+def _build_chunks(task):
+    """Build and encode the chunks of one task, in a worker process.
+
+    :param task: ``(first chunk index, start, stop)`` into the shared recipients.
+
+    :rtype: list of ``(chunk index, recipients, idempotency key, body, content encoding,
+        payload size, validation errors)``; an invalid payload has no body.
+    """
+    first, start, stop = task
+    recipients = _worker['recipients']
+    options = _worker['options']
+    chunk_size = options['chunk_size']
+
+    results = []
+    for index, offset in enumerate(range(start, stop, chunk_size), first):
+        end = min(offset + chunk_size, stop)
+        packed = recipients[offset * PLAYER_ID_SIZE:end * PLAYER_ID_SIZE]
+        player_ids = [str(uuid.UUID(bytes=packed[i:i + PLAYER_ID_SIZE]))
+                      for i in range(0, len(packed), PLAYER_ID_SIZE)]
+
+        payloads = _worker['build'](player_ids, _worker['context'])
+        if isinstance(payloads, dict):
+            payloads = [payloads]
+
+        for n, payload in enumerate(payloads):
+            payload.setdefault('include_player_ids', player_ids)
+            payload['app_id'] = options['app_id']
+            key = payload['external_id'] = chunk_key(options['campaign_id'], '{}.{}'.format(index, n))
+
+            if options['validate']:
+                payload, errors = VALIDATORS['notifications_create'](payload)
+                if errors:
+                    results.append((index, len(payload['include_player_ids']), key, None, None, 0,
+                                    errors))
+                    continue
+
+            body = json.dumps(payload).encode('utf-8')
+            size = len(body)
+            encoding = None
+            if options['compress_threshold'] is not None and size >= options['compress_threshold']:
+                body = gzip_compress(body, options['compress_level'])
+                encoding = 'gzip'
+
+            results.append((index, len(payload['include_player_ids']), key, body, encoding, size,
+                            None))
+
+    return results
+
+
+class Campaign(object):
+    """Build notification bodies in a process pool and send them from a thread pool.
+
+    :param onesignal: The :class:`onesignal.OneSignal` client used to send; its
+        ``app_id``, ``compress_threshold`` and ``dedupe_index`` apply.
+    :param build: (optional) Module level function ``build(player_ids, context)``
+        returning notification fields for a chunk. Defaults to sending ``context``.
+    :param processes: (optional) Worker processes, defaults to the number of CPUs.
+    :param connections: (optional) Concurrent sends, each on its own pooled connection.
+    :param chunk_size: (optional) Player ids per notification, at most 2000.
+    :param chunks_per_task: (optional) Chunks built per worker task.
+
+    """
+    def __init__(self, onesignal, build=default_build, processes=None, connections=8,
+                 chunk_size=MAX_PLAYER_IDS, chunks_per_task=4):
+        if not 0 < chunk_size <= MAX_PLAYER_IDS:
+            raise ValueError('chunk_size must be between 1 and {}.'.format(MAX_PLAYER_IDS))
+
+        self.onesignal = onesignal
+        self.build = build
+        self.processes = processes or multiprocessing.cpu_count()
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.chunks_per_task = chunks_per_task
+
+    def __repr__(self):
+        return '<Campaign: %d processes, %d connections>' % (self.processes, self.connections)
+
+    @staticmethod
+    def share(player_ids):
+        """Pack player ids into a shared memory array readable by every worker.
+
+        :param player_ids: Player id strings, or a :class:`onesignal.recipients.RecipientSet`.
+
+        :rtype: :class:`multiprocessing.sharedctypes.RawArray` of ``16 * len(player_ids)`` bytes
+        """
+        if isinstance(player_ids, RecipientSet):
+            packed = player_ids.packed[:]
+        else:
+            packed = b''.join(pack_player_id(player_id) for player_id in player_ids)
+        shared = RawArray(ctypes.c_char, len(packed))
+        ctypes.memmove(shared, packed, len(packed))
+
+        return shared
+
+    def session(self):
+        """A session for the sender threads, with one keep-alive connection per thread.
+
+        It copies the client's headers, auth and retries, so the client's own session and
+        adapters are left alone.
+        """
+        client = self.onesignal.client
+
+        session = requests.Session()
+        session.headers = client.headers.copy()
+        session.auth = client.auth
+        session.proxies = client.proxies.copy()
+        session.verify = client.verify
+        session.cert = client.cert
+
+        retries = client.get_adapter(self.onesignal.api_url).max_retries
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.connections,
+                              max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def tasks(self, count):
+        step = self.chunk_size * self.chunks_per_task
+        for n, start in enumerate(range(0, count, step)):
+            yield n * self.chunks_per_task, start, min(start + step, count)
+
+    def run(self, recipients, context=None, campaign_id=None):
+        """Build and send one notification per chunk of ``recipients``.
+
+        :param recipients: Player id strings, a :class:`onesignal.recipients.RecipientSet`,
+            or an array returned by :meth:`share`.
+        :param context: (optional) Passed to ``build`` with every chunk; must be picklable.
+        :param campaign_id: (optional) Derive each chunk's idempotency key from this, so a
+            campaign that is run again with the same id and recipients in the same order does
+            not notify anyone twice. A random one is used when omitted.
+
+        :rtype: dict
+        """
+        if not isinstance(recipients, ctypes.Array):
+            recipients = self.share(recipients)
+        count = len(recipients) // PLAYER_ID_SIZE
+
+        options = {
+            'app_id': self.onesignal.app_id,
+            'campaign_id': campaign_id or str(uuid.uuid4()),
+            'chunk_size': self.chunk_size,
+            'compress_threshold': self.onesignal.compress_threshold,
+            'compress_level': self.onesignal.compress_level,
+            'validate': self.onesignal.validate_payloads,
+        }
+
+        summary = {
+            'chunks': 0, 'payloads': 0, 'sent': 0, 'skipped': 0, 'invalid': 0, 'failed': 0,
+            'recipients': 0,
+            'notification_ids': [], 'errors': [],
+        }
+        chunks = set()
+        lock = threading.Lock()
+        queue = Queue(maxsize=self.connections * 4)
+        session = self.session()
+
+        # fork the workers before any sender thread exists
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (recipients, self.build, context, options))
+
+        senders = [threading.Thread(target=self._sender,
+                                    args=(queue, session, summary, chunks, lock))
+                   for _ in range(self.connections)]
+        for sender in senders:
+            sender.daemon = True
+            sender.start()
+
+        # a bounded window of tasks in flight keeps built bodies from piling up
+        # in memory when sending is the bottleneck
+        pending = deque()
+        try:
+            for task in self.tasks(count):
+                pending.append(pool.apply_async(_build_chunks, (task,)))
+                if len(pending) >= self.processes * 2:
+                    for result in pending.popleft().get():
+                        queue.put(result)
+            while pending:
+                for result in pending.popleft().get():
+                    queue.put(result)
+        finally:
+            for _ in senders:
+                queue.put(None)
+            pool.close()
+            pool.join()
+
+        for sender in senders:
+            sender.join()
+        session.close()
+
+        summary['chunks'] = len(chunks)
+
+        return summary
+
+    def _sender(self, queue, session, summary, chunks, lock):
+        onesignal = self.onesignal
+        index = onesignal.dedupe_index
+
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+
+            chunk, recipients, key, body, encoding, size, errors = item
+
+            if errors:
+                error = OneSignalValidationError(
+                    'Invalid notifications_create payload: {}'.format(' '.join(errors)), errors)
+                with lock:
+                    chunks.add(chunk)
+                    summary['payloads'] += 1
+                    summary['invalid'] += 1
+                    summary['errors'].append((chunk, error))
+                continue
+
+            if index is not None and key in index:
+                with lock:
+                    chunks.add(chunk)
+                    summary['payloads'] += 1
+                    summary['skipped'] += 1
+                continue
+
+            try:
+                content = onesignal.send_encoded('POST', 'notifications', body, encoding, size,
+                                                 session=session)
+            except (OneSignalApiError, requests.RequestException) as e:
+                with lock:
+                    chunks.add(chunk)
+                    summary['payloads'] += 1
+                    summary['failed'] += 1
+                    summary['errors'].append((chunk, e))
+                continue
+
+            if index is not None:
+                index.add(key, content.get('id'))
+
+            with lock:
+                chunks.add(chunk)
+                summary['payloads'] += 1
+                summary['sent'] += 1
+                summary['recipients'] += recipients
+                summary['notification_ids'].append(content.get('id'))
+
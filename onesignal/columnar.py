@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.columnar
+~~~~~~~~~~~~~~~~~
+
+This module contains a columnar on-disk format for ``csv_export`` data, so an
+export is downloaded and parsed once and then read many times.
+
+Every column is one file of fixed-width values: ``int`` and ``bool`` columns
+as int64 and int8, ``float`` as float64, and ``str`` columns as int32 codes
+into a dictionary of distinct values, stored as concatenated utf-8 plus an
+int64 offsets file. Files are memory mapped on open, so opening is instant
+and a query only touches the pages of the columns it reads.
+
+Usage::
+
+  >>> export = onesignal.csv_export()
+  >>> convert(export['csv_file_url'], 'players.columnar')
+  >>> players = ColumnarExport('players.columnar')
+  >>> for row in players.rows(['id', 'amount_spent'], where={'language': 'es'}):
+  ...     print(row)
+  >>> apply_delta('players.columnar', newer_export['csv_file_url'])
+
+A delta writes every column to new files and then replaces ``meta.json``,
+which names the files of each column, in one rename: an interrupted delta
+leaves the directory as it was.
+
+The module relies on ``memoryview.cast`` and ``array.tobytes``/``frombytes``,
+so converting and reading both need Python 3.
+"""
+
+import bisect
+import csv
+import gzip
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+from array import array
+
+import requests
+
+#: Types of the numeric columns OneSignal exports, every other column is ``str``.
+DEFAULT_SCHEMA = {
+    'session_count': 'int',
+    'timezone': 'int',
+    'device_type': 'int',
+    'last_active': 'int',
+    'playtime': 'int',
+    'created_at': 'int',
+    'badge_count': 'int',
+    'amount_spent': 'float',
+    'invalid_identifier': 'bool',
+}
+
+TYPECODES = {'int': 'q', 'float': 'd', 'bool': 'b', 'str': 'i'}
+
+#: Stored for a missing ``int`` value; ``float`` uses NaN and ``str`` code -1.
+NULL_INT = -2 ** 63
+
+#: Rows read to check column types.
+SAMPLE_ROWS = 1000
+
+#: Bytes of CSV parsed per worker task.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+#: Version of the ``meta.json`` layout, checked when a directory is opened.
+FORMAT_VERSION = 1
+
+_TRUE = frozenset(['t', 'true', '1', 'True', 'TRUE'])
+_FALSE = frozenset(['f', 'false', '0', 'False', 'FALSE'])
+
+
+def _parse(value, kind):
+    if kind == 'int':
+        return int(value) if value else NULL_INT
+    if kind == 'float':
+        return float(value) if value else float('nan')
+    if value in _TRUE:
+        return 1
+    if value in _FALSE:
+        return 0
+    if value:
+        raise ValueError('invalid literal for bool: {!r}'.format(value))
+    return -1
+
+
+def _parses(values, kind):
+    try:
+        for value in values:
+            _parse(value, kind)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_types(names, sample, schema):
+    """Types of ``names`` from ``schema``, falling back to ``str`` where the sample doesn't parse."""
+    types = []
+    for i, name in enumerate(names):
+        kind = schema.get(name, 'str')
+        if kind != 'str' and not _parses([row[i] if i < len(row) else '' for row in sample], kind):
+            kind = 'str'
+        types.append(kind)
+
+    return types
+
+
+def _parse_chunk(task):
+    """Parse the CSV rows in a byte range of a file, in a worker process.
+
+    :rtype: ``(rows, columns)`` where each column is the raw bytes of its values,
+        or for ``str`` columns ``(distinct values, raw bytes of local codes)``.
+    """
+    path, start, end, names, types = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    width = len(types)
+    columns = [[] for _ in types]
+    rows = 0
+    for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        for values, value in zip(columns, row):
+            values.append(value)
+        rows += 1
+
+    out = []
+    for name, values, kind in zip(names, columns, types):
+        if kind == 'str':
+            local = {}
+            codes = array('i', [local.setdefault(v, len(local)) if v else -1 for v in values])
+            out.append((sorted(local, key=local.get), codes.tobytes()))
+        else:
+            try:
+                parsed = [_parse(value, kind) for value in values]
+            except ValueError as e:
+                # the type came from the first rows: storing null would lose the value
+                raise ValueError('Column {} holds {} values in its first rows but not later: {}. '
+                                 'Give it the str type in the schema.'.format(name, kind, e))
+            out.append(array(TYPECODES[kind], parsed).tobytes())
+
+    return rows, out
+
+
+def _fetch(source, directory):
+    """Download and decompress ``source`` (a url or a path, gzipped or not) to a plain CSV file."""
+    if source.startswith(('https://', 'http://')):
+        response = requests.get(source, stream=True)
+        response.raise_for_status()
+        local = os.path.join(directory, 'export.csv.gz')
+        with open(local, 'wb') as f:
+            for block in response.iter_content(1024 * 1024):
+                f.write(block)
+        source = local
+
+    with open(source, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+    if not gzipped:
+        return source
+
+    plain = os.path.join(directory, 'export.csv')
+    with gzip.open(source, 'rb') as src, open(plain, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    return plain
+
+
+def _record_end(f, quotes):
+    """Read on to the end of the CSV record the file position is in.
+
+    Quotes always come in pairs, ``""`` included, so a line break ends a record only
+    after an even number of them; an odd number means it is inside a quoted field.
+
+    :param quotes: Quotes read since the last record boundary.
+    """
+    while True:
+        line = f.readline()
+        quotes += line.count(b'"')
+        if not line or quotes % 2 == 0:
+            return f.tell()
+
+
+def _split(path, chunk_size):
+    """Byte ranges of ``path`` after its header, each ending on a record boundary."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = _record_end(f, 0)
+        while start < size:
+            # counting the quotes on the way tells whether the line it lands in is quoted
+            quotes = f.read(chunk_size).count(b'"')
+            end = min(_record_end(f, quotes), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def _read_header(path):
+    with io.open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        sample = [row for _, row in zip(range(SAMPLE_ROWS), reader)]
+
+    return names, sample
+
+
+def _parse_export(source, processes, chunk_size, resolve_types):
+    """Yield the column names and types of ``source``, then each of its parsed chunks in order.
+
+    :param resolve_types: Called with the header names and sample rows, returns the column types.
+    """
+    directory = tempfile.mkdtemp(prefix='onesignal-export-')
+    try:
+        path = _fetch(source, directory)
+        names, sample = _read_header(path)
+        types = resolve_types(names, sample)
+        yield names, types
+
+        tasks = [(path, start, end, names, types) for start, end in _split(path, chunk_size)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            for chunk in pool.imap(_parse_chunk, tasks):
+                yield chunk
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _chunk_values(column, kind):
+    """Parsed chunk column back to a list of values, strings for ``str`` columns."""
+    if kind == 'str':
+        local, raw = column
+        codes = array('i')
+        codes.frombytes(raw)
+        return [local[c] if c >= 0 else '' for c in codes]
+
+    values = array(TYPECODES[kind])
+    values.frombytes(column)
+    return values
+
+
+class _ColumnWriter(object):
+    """Writes the files of one column, appending to the dictionary of a ``str`` column
+    when its ``.dict`` and ``.off`` files already exist."""
+
+    def __init__(self, path, kind, base):
+        self.kind = kind
+        self.typecode = TYPECODES[self.kind]
+        base = os.path.join(path, base)
+
+        self.values = open(base + '.col', 'wb')
+        self.strings = None
+        if self.kind == 'str':
+            exists = os.path.exists(base + '.dict')
+            self.dict = open(base + '.dict', 'r+b' if exists else 'w+b')
+            self.offsets = open(base + '.off', 'r+b' if exists else 'w+b')
+            self.strings = {}
+            if exists:
+                data = self.dict.read()
+                offsets = array('q')
+                offsets.frombytes(self.offsets.read())
+                for i in range(len(offsets) - 1):
+                    self.strings[data[offsets[i]:offsets[i + 1]].decode('utf-8')] = i
+                self.end = offsets[-1]
+            else:
+                self.offsets.write(array('q', [0]).tobytes())
+                self.end = 0
+            self.dict.seek(0, os.SEEK_END)
+            self.offsets.seek(0, os.SEEK_END)
+
+    def code(self, value):
+        code = self.strings.get(value)
+        if code is None:
+            code = self.strings[value] = len(self.strings)
+            encoded = value.encode('utf-8')
+            self.dict.write(encoded)
+            self.end += len(encoded)
+            self.offsets.write(array('q', [self.end]).tobytes())
+
+        return code
+
+    def append(self, column):
+        """Append the values of one parsed chunk."""
+        if self.kind != 'str':
+            self.values.write(column)
+            return
+
+        local, raw = column
+        mapping = [self.code(value) for value in local]
+        codes = array('i')
+        codes.frombytes(raw)
+        self.values.write(array('i', [mapping[c] if c >= 0 else -1 for c in codes]).tobytes())
+
+    def close(self):
+        self.values.close()
+        if self.kind == 'str':
+            self.dict.close()
+            self.offsets.close()
+
+
+def _column_files(base, kind):
+    return [base + ext for ext in (('.col', '.dict', '.off') if kind == 'str' else ('.col',))]
+
+
+def _write_meta(path, names, types, rows, files, generation=0):
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': rows,
+        'generation': generation,
+        'columns': [{'name': name, 'type': kind, 'file': base}
+                    for name, kind, base in zip(names, types, files)],
+    }
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, os.path.join(path, 'meta.json'))
+
+
+def _rewrite_column(task):
+    """Write one column with a delta applied to new files, in a worker process.
+
+    :param task: ``(directory, old base, new base, type, old rows, new rows, raw int64 target
+        row of each delta row, parsed delta chunks of the column or None)``.
+    """
+    path, old, new, kind, old_rows, rows, targets, chunks = task
+    typecode = TYPECODES[kind]
+
+    values = array(typecode)
+    with open(os.path.join(path, old + '.col'), 'rb') as f:
+        values.frombytes(f.read(old_rows * values.itemsize))
+    null = -1 if kind == 'str' else _parse('', kind)
+    values.extend(array(typecode, [null]) * (rows - old_rows))
+
+    if kind == 'str':
+        # the new dictionary starts as a copy of the old one, codes stay valid
+        shutil.copyfile(os.path.join(path, old + '.dict'), os.path.join(path, new + '.dict'))
+        shutil.copyfile(os.path.join(path, old + '.off'), os.path.join(path, new + '.off'))
+    writer = _ColumnWriter(path, kind, new)
+
+    try:
+        if chunks is not None:
+            rows_of = array('q')
+            rows_of.frombytes(targets)
+            i = 0
+            for chunk in chunks:
+                if kind == 'str':
+                    local, raw = chunk
+                    mapping = [writer.code(value) for value in local]
+                    delta = array('i')
+                    delta.frombytes(raw)
+                    for c in delta:
+                        values[rows_of[i]] = mapping[c] if c >= 0 else -1
+                        i += 1
+                else:
+                    delta = array(typecode)
+                    delta.frombytes(chunk)
+                    for value in delta:
+                        values[rows_of[i]] = value
+                        i += 1
+
+        writer.values.write(values.tobytes())
+        for f in (writer.values, writer.dict, writer.offsets) if kind == 'str' else (writer.values,):
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        writer.close()
+
+
+def convert(source, path, processes=None, chunk_size=CHUNK_SIZE, schema=None):
+    """Parse a ``csv_export`` file once into a columnar directory at ``path``.
+
+    :param source: The ``csv_file_url`` of an export, or the path of a downloaded one.
+    :param path: Directory to create.
+    :param processes: (optional) Parser processes, defaults to the number of CPUs.
+    :param chunk_size: (optional) Bytes of CSV per parser task.
+    :param schema: (optional) Dict of column name to ``int``, ``float``, ``bool`` or ``str``,
+        added to ``DEFAULT_SCHEMA``. A column whose first rows don't parse as its type is
+        stored as ``str``.
+
+    :rtype: :class:`ColumnarExport`
+    :raises: ValueError when a later value doesn't parse as the type of its column; ``path``
+        is removed then.
+    """
+    schema = dict(DEFAULT_SCHEMA, **(schema or {}))
+    os.makedirs(path)
+
+    try:
+        chunks = _parse_export(source, processes, chunk_size,
+                               lambda names, sample: _check_types(names, sample, schema))
+        names, types = next(chunks)
+        files = ['c{}'.format(i) for i in range(len(names))]
+        writers = [_ColumnWriter(path, kind, base) for kind, base in zip(types, files)]
+
+        rows = 0
+        try:
+            for count, columns in chunks:
+                for writer, column in zip(writers, columns):
+                    writer.append(column)
+                rows += count
+        finally:
+            for writer in writers:
+                writer.close()
+
+        _write_meta(path, names, types, rows, files)
+    except BaseException:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    return ColumnarExport(path)
+
+
+def apply_delta(path, source, processes=None, chunk_size=CHUNK_SIZE, key='id'):
+    """Apply a newer export to a columnar directory.
+
+    Players whose ``key`` is already stored are overwritten, new ones are appended.
+    Delta columns the directory doesn't have are ignored, and columns missing from
+    the delta are left as they were (null for new players).
+
+    The delta is parsed in a process pool, then each column is rewritten in bulk to
+    new files by a worker, and ``meta.json`` is swapped to them last. Until then
+    readers, and the directory after a crash, see the previous version.
+
+    :param path: A directory written by :func:`convert`.
+    :param source: The ``csv_file_url`` of the newer export, or its path.
+    :param processes: (optional) Parser and writer processes, defaults to the number of CPUs.
+
+    :rtype: :class:`ColumnarExport`
+    """
+    current = ColumnarExport(path)
+    names = current.names
+    types = [current.types[name] for name in names]
+    old_files = current.files
+    generation = current.meta['generation'] + 1
+    positions = dict((value, row) for row, value in enumerate(current.column(key)))
+    old_rows = rows = len(current)
+    current.close()
+
+    # the delta is parsed with the stored types, matching its columns by name
+    chunks = _parse_export(source, processes, chunk_size, lambda delta_names, sample: [
+        current.types.get(name, 'str') for name in delta_names])
+    delta_names, delta_types = next(chunks)
+    if key not in delta_names:
+        chunks.close()
+        raise ValueError('The delta export has no {} column.'.format(key))
+
+    key_index = delta_names.index(key)
+    delta_columns = [[] for _ in delta_names]
+    targets = array('q')
+    for count, columns in chunks:
+        for player in _chunk_values(columns[key_index], delta_types[key_index]):
+            row = positions.get(player)
+            if row is None:
+                row = positions[player] = rows
+                rows += 1
+            targets.append(row)
+        for stored, column in zip(delta_columns, columns):
+            stored.append(column)
+
+    targets = targets.tobytes()
+    files = ['c{}.{}'.format(i, generation) for i in range(len(names))]
+    tasks = []
+    for name, kind, old, new in zip(names, types, old_files, files):
+        column = delta_columns[delta_names.index(name)] if name in delta_names else None
+        tasks.append((path, old, new, kind, old_rows, rows, targets, column))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(_rewrite_column, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    _write_meta(path, names, types, rows, files, generation)
+
+    for old, kind in zip(old_files, types):
+        for filename in _column_files(old, kind):
+            try:
+                os.remove(os.path.join(path, filename))
+            except OSError:
+                pass
+
+    return ColumnarExport(path)
+
+
+class StringColumn(object):
+    """A dictionary encoded column: ``codes`` into ``len(dictionary)`` distinct strings."""
+
+    def __init__(self, codes, data, offsets):
+        self.codes = codes
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return '<StringColumn: %d rows, %d distinct>' % (len(self), len(self._offsets) - 1)
+
+    def string(self, code):
+        """The string for a dictionary ``code``, or ``None`` for -1."""
+        if code < 0:
+            return None
+
+        return self._data[self._offsets[code]:self._offsets[code + 1]].decode('utf-8')
+
+    def code(self, value):
+        """The dictionary code of ``value``, or ``None`` if no row has it."""
+        encoded = value.encode('utf-8')
+        offsets = self._offsets
+
+        # find the string in the dictionary data, then check it starts and ends on entry bounds
+        position = self._data.find(encoded)
+        while position >= 0:
+            code = bisect.bisect_left(offsets, position)
+            if (code < len(offsets) - 1 and offsets[code] == position and
+                    offsets[code + 1] == position + len(encoded)):
+                return code
+            position = self._data.find(encoded, position + 1)
+
+        return None
+
+    def __getitem__(self, row):
+        return self.string(self.codes[row])
+
+    def __iter__(self):
+        string = self.string
+        cache = {}
+        for code in self.codes:
+            value = cache.get(code)
+            if value is None:
+                value = cache[code] = string(code)
+            yield value
+
+
+class ColumnarExport(object):
+    """Read a directory written by :func:`convert`.
+
+    Columns are memory mapped lazily, the first time they are used. Numeric
+    columns are ``memoryview`` objects over the file (NULL_INT or NaN where the
+    export had no value), string columns are :class:`StringColumn`.
+
+    :param path: A directory written by :func:`convert`.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError('{} is not a columnar export of version {}.'.format(path,
+                                                                                FORMAT_VERSION))
+
+        self.names = [c['name'] for c in self.meta['columns']]
+        self.types = dict((c['name'], c['type']) for c in self.meta['columns'])
+        #: Base name of each column's files, in ``names`` order.
+        self.files = [c['file'] for c in self.meta['columns']]
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+        self._columns = {}
+        self._maps = []
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __repr__(self):
+        return '<ColumnarExport: %d rows, %d columns>' % (len(self), len(self.names))
+
+    def _map(self, filename, typecode=None):
+        """Memory map a file, as a typed memoryview when ``typecode`` is given."""
+        with open(os.path.join(self.path, filename), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                mapped = b''
+            else:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+
+        return memoryview(mapped).cast(typecode) if typecode else mapped
+
+    def column(self, name):
+        """All values of one column, read from its memory map."""
+        column = self._columns.get(name)
+        if column is not None:
+            return column
+
+        kind = self.types[name]
+        base = self.files[self._index[name]]
+        values = self._map(base + '.col', TYPECODES[kind])
+        if kind == 'str':
+            values = StringColumn(values, self._map(base + '.dict'), self._map(base + '.off', 'q'))
+
+        self._columns[name] = values
+        return values
+
+    def where(self, **conditions):
+        """Row numbers matching every condition, reading only the columns involved.
+
+        Each condition is either a value to compare with, or a predicate called
+        with the column value. String equality is checked on dictionary codes.
+
+        :rtype: list of int
+        """
+        selected = None
+        for name, condition in sorted(conditions.items(), key=lambda c: callable(c[1])):
+            column = self.column(name)
+            if isinstance(column, StringColumn):
+                if callable(condition):
+                    # a predicate runs once per distinct string, not once per row
+                    matches = [condition(column.string(c)) for c in range(len(column._offsets) - 1)]
+                    test = lambda code: code >= 0 and matches[code]  # noqa
+                else:
+                    code = column.code(condition)
+                    test = lambda value, code=code: value == code  # noqa
+                values = column.codes
+            else:
+                test = condition if callable(condition) else (lambda v, c=condition: v == c)
+                values = column
+
+            if selected is None:
+                selected = [row for row, value in enumerate(values) if test(value)]
+            else:
+                selected = [row for row in selected if test(values[row])]
+
+            if not selected:
+                break
+
+        return list(range(len(self))) if selected is None else selected
+
+    def rows(self, columns=None, where=None):
+        """Iterate over rows as dicts of the projected ``columns`` (all by default).
+
+        :param columns: (optional) Names of the columns to read.
+        :param where: (optional) Dict of conditions, as for :meth:`where`.
+        """
+        columns = columns or self.names
+        views = [(name, self.column(name)) for name in columns]
+        selected = self.where(**where) if where else range(len(self))
+
+        for row in selected:
+            yield dict((name, view[row]) for name, view in views)
+
+    def close(self):
+        self._columns.clear()
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # a caller still holds a view, leave it to the garbage collector
+                pass
+        self._maps = []
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.compat
+~~~~~~~~~~~~~~~
+
+This module contains imports and declarations for seamless Python 2 and
+Python 3 compatibility.
+"""
+
+import sys
+
+_ver = sys.version_info
+
+#: Python 2.x?
+is_py2 = (_ver[0] == 2)
+
+#: Python 3.x?
+is_py3 = (_ver[0] == 3)
+
+if is_py2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from time import time as timer
+    from time import time as monotonic
+    from Queue import Empty, Queue
+
+    bytes = str  # noqa
+    str = unicode  # noqa
+    basestring = basestring  # noqa
+    range = xrange  # noqa
+    bytes_view = buffer  # noqa
+
+elif is_py3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+    from time import perf_counter as timer
+    from time import monotonic
+    from queue import Empty, Queue
+
+    str = str
+    basestring = (str, bytes)
+    bytes = bytes
+    range = range
+    bytes_view = memoryview
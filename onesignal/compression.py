@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.compression
+~~~~~~~~~~~~~~~~~~~~
+
+This module contains gzip helpers for request bodies.
+"""
+
+import zlib
+
+from .compat import bytes_view
+
+#: Bytes handed to the compressor at a time.
+CHUNK_SIZE = 64 * 1024
+
+#: zlib window bits selecting a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gzip_compress(body, level=6):
+    """Gzip ``body`` through a streaming compressor, ``CHUNK_SIZE`` bytes at a time.
+
+    The compressor is fed slices of a view over ``body``, so the input is not
+    copied again on Python 3.
+
+    :param body: The bytes to compress.
+    :param level: (optional) zlib compression level, 1 (fastest) to 9 (smallest).
+
+    :rtype: bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    view = bytes_view(body)
+
+    chunks = [compressor.compress(view[i:i + CHUNK_SIZE]) for i in range(0, len(view), CHUNK_SIZE)]
+    chunks.append(compressor.flush())
+
+    return b''.join(chunks)
+
+
+def gzip_decompress(body):
+    """Inverse of :func:`gzip_compress`.
+
+    :rtype: bytes
+    """
+    return zlib.decompress(body, GZIP_WBITS)
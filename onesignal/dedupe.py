@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.dedupe
+~~~~~~~~~~~~~~~
+
+This module contains an index of recently sent idempotency keys, used by
+:meth:`onesignal.OneSignal.notifications_create` to skip sends it has already
+seen succeed.
+
+:class:`LRUKeyIndex` is exact and remembers the notification id of each key.
+Its memory is bounded by ``capacity``, at about 150 bytes a key, and adding a
+key takes a few microseconds. Any object with the same ``__contains__``,
+``add`` and ``notification_id`` methods can stand in for it, i.e. one backed by
+a shared store, as long as its hits are exact: a hit skips the send.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUKeyIndex(object):
+    """Exact index of the ``capacity`` most recently added keys.
+
+    :param capacity: (optional) Number of keys kept before the oldest is evicted.
+
+    """
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<LRUKeyIndex: %d/%d keys>' % (len(self), self.capacity)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def add(self, key, notification_id=None):
+        with self._lock:
+            self._keys.pop(key, None)
+            self._keys[key] = notification_id
+            if len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+    def notification_id(self, key):
+        """The notification id recorded for ``key``, if any."""
+        with self._lock:
+            return self._keys.get(key)
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.emulator
+~~~~~~~~~~~~~~~~~
+
+This module contains a local HTTP server that emulates the OneSignal REST
+API endpoints used by :class:`onesignal.OneSignal`, for load testing without
+touching the real service.
+
+Latency, server errors and rate limiting (``429`` with ``Retry-After``) can be
+injected at configurable rates. Players are synthesized on demand from their
+index, so ``players`` paging and ``csv_export`` work over millions of rows
+without holding them in memory: an export download is gzipped and sent in
+chunks as its rows are generated. Rows take about 30 microseconds each, so
+``--export-rows`` keeps the downloads of a large app short.
+
+Usage::
+
+  $ python -m onesignal.emulator --port 8080 --players 5000000 \\
+        --latency lognormal:0.04,0.5 --error-rate 0.01 --rate-limit-rate 0.02
+
+  >>> onesignal = OneSignal(API_KEY, APP_ID, api_base='http://127.0.0.1:8080/api')
+
+"""
+
+import argparse
+import gzip
+import io
+import json
+import math
+import random
+import threading
+import time
+import types
+import uuid
+import zlib
+from collections import OrderedDict
+
+from .compat import BaseHTTPRequestHandler, HTTPServer, ThreadingMixIn, parse_qs, urlparse
+from .compression import gzip_compress, gzip_decompress
+
+#: Largest page the real API returns from ``GET players``.
+MAX_PLAYERS_LIMIT = 300
+
+#: Smallest JSON response gzipped for clients sending ``Accept-Encoding: gzip``.
+GZIP_MIN_SIZE = 1024
+
+#: Number of created notifications kept for ``GET notifications``.
+MAX_NOTIFICATIONS = 10000
+
+#: Number of ``csv_export`` urls kept downloadable; older ones answer ``404``.
+MAX_EXPORTS = 1000
+
+#: Bytes of gzipped ``csv_export`` body sent per chunk.
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+#: Columns written to synthetic ``csv_export`` files, in the order OneSignal uses.
+CSV_EXPORT_COLUMNS = (
+    'id', 'identifier', 'session_count', 'language', 'timezone', 'game_version',
+    'device_os', 'device_type', 'device_model', 'ad_id', 'tags', 'last_active',
+    'playtime', 'amount_spent', 'created_at', 'invalid_identifier', 'badge_count',
+)
+
+_LANGUAGES = ('en', 'es', 'fr', 'de', 'pt', 'ja', 'zh-Hans', 'ru')
+_MODELS = ('iPhone', 'iPhone9,3', 'Pixel', 'SM-G930F', 'Chrome', 'Firefox')
+
+
+def _csv_field(value):
+    if ',' in value or '"' in value or '\n' in value:
+        return '"%s"' % value.replace('"', '""')
+
+    return value
+
+
+class Latency(object):
+    """A latency distribution, sampled once per emulated request.
+
+    :param kind: ``fixed``, ``uniform``, ``lognormal`` or ``pareto``.
+    :param params: Seconds. ``fixed``: value. ``uniform``: low, high.
+        ``lognormal``: median, sigma. ``pareto``: minimum, alpha.
+    :param spike_rate: (optional) Fraction of requests that are additionally
+        delayed by ``spike``, to reproduce the occasional very slow response.
+    :param spike: (optional) Extra seconds added to a spiking request.
+
+    """
+    KINDS = ('fixed', 'uniform', 'lognormal', 'pareto')
+
+    def __init__(self, kind='fixed', params=(0.0,), spike_rate=0.0, spike=0.0):
+        if kind not in self.KINDS:
+            raise ValueError('Unknown latency distribution: {}'.format(kind))
+
+        self.kind = kind
+        self.params = tuple(float(p) for p in params)
+        self.spike_rate = spike_rate
+        self.spike = spike
+
+    @classmethod
+    def from_spec(cls, spec, **kwargs):
+        """Build a distribution from a ``kind:param,param`` string, i.e. ``lognormal:0.04,0.5``."""
+        kind, _, params = spec.partition(':')
+        params = [p for p in params.split(',') if p] or [0.0]
+
+        return cls(kind, params, **kwargs)
+
+    def sample(self, rng=random):
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(self.params[0], self.params[1])
+        elif self.kind == 'lognormal':
+            value = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        else:
+            value = self.params[0] * rng.paretovariate(self.params[1])
+
+        if self.spike_rate and rng.random() < self.spike_rate:
+            value += self.spike
+
+        return max(value, 0.0)
+
+    def __repr__(self):
+        return '<Latency: %s%r>' % (self.kind, self.params)
+
+
+class Emulator(object):
+    """State and behaviour of an emulated OneSignal app.
+
+    :param players: (optional) Number of synthetic players, defaults to 1,000,000.
+    :param latency: (optional) A :class:`Latency` applied to every request.
+    :param error_rate: (optional) Fraction of requests answered with a ``500``.
+    :param rate_limit_rate: (optional) Fraction of requests answered with a ``429``.
+    :param retry_after: (optional) Seconds advertised in ``Retry-After`` on a ``429``.
+    :param export_delay: (optional) Seconds before a ``csv_export`` file becomes downloadable.
+    :param export_rows: (optional) Cap on rows written to a ``csv_export`` file,
+        defaults to every player.
+    :param seed: (optional) Seed for the fault injection random generator.
+
+    """
+    def __init__(self, players=1000000, latency=None, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, export_delay=2.0, export_rows=None, seed=None):
+        self.players = players
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.export_delay = export_delay
+        self.export_rows = export_rows
+
+        self.app_id = str(uuid.UUID(int=0xa99))
+        self.notifications = OrderedDict()
+        self.external_ids = {}
+        self.exports = OrderedDict()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Emulator: %d players>' % self.players
+
+    def fault(self):
+        """Return the ``(status, headers, body)`` of an injected fault, or ``None``."""
+        with self._lock:
+            roll = self._rng.random()
+            delay = self.latency.sample(self._rng)
+
+        time.sleep(delay)
+
+        if roll < self.rate_limit_rate:
+            return 429, {'Retry-After': str(self.retry_after)}, {'errors': ['Rate limit exceeded']}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {}, {'errors': ['Internal server error']}
+
+        return None
+
+    def player_id(self, index):
+        return str(uuid.UUID(int=(0x5eed << 64) | index))
+
+    def player_index(self, player_id):
+        try:
+            value = uuid.UUID(player_id).int
+        except ValueError:
+            return None
+
+        if value >> 64 != 0x5eed or (value & 0xffffffffffffffff) >= self.players:
+            return None
+
+        return value & 0xffffffffffffffff
+
+    def player(self, index):
+        """Synthesize the player at ``index``, always the same for a given index."""
+        rng = random.Random(index)
+
+        return {
+            'id': self.player_id(index),
+            'identifier': '%064x' % rng.getrandbits(256),
+            'session_count': rng.randint(1, 500),
+            'language': rng.choice(_LANGUAGES),
+            'timezone': rng.choice((-28800, -18000, 0, 3600, 19800, 32400)),
+            'game_version': '1.%d' % rng.randint(0, 9),
+            'device_os': '%d.%d' % (rng.randint(5, 12), rng.randint(0, 4)),
+            'device_type': rng.randint(0, 9),
+            'device_model': rng.choice(_MODELS),
+            'ad_id': None,
+            'tags': {'level': str(rng.randint(1, 80)), 'cohort': 'c%d' % (index % 16)},
+            'last_active': 1480000000 + rng.randint(0, 10000000),
+            'playtime': rng.randint(0, 100000),
+            'amount_spent': round(rng.random() * 20, 2),
+            'created_at': 1400000000 + index % 80000000,
+            'invalid_identifier': rng.random() < 0.02,
+            'badge_count': rng.randint(0, 5),
+        }
+
+    def csv_export(self, rows=None):
+        """Yield the gzipped CSV body of an export with ``rows`` rows, in blocks of about
+        ``EXPORT_BLOCK_SIZE`` bytes, generating the rows as they are written.
+
+        :param rows: (optional) Defaults to every player, capped by ``export_rows``.
+        """
+        if rows is None:
+            rows = self.players if self.export_rows is None else min(self.players, self.export_rows)
+
+        buf = io.BytesIO()
+        # a fixed mtime makes every download of the same rows identical
+        f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1, mtime=0)
+        f.write((','.join(CSV_EXPORT_COLUMNS) + '\n').encode('utf-8'))
+        for index in range(rows):
+            player = self.player(index)
+            values = []
+            for column in CSV_EXPORT_COLUMNS:
+                value = player[column]
+                if value is None:
+                    value = ''
+                elif column == 'tags':
+                    value = json.dumps(value)
+                elif isinstance(value, bool):
+                    value = 't' if value else 'f'
+                values.append(_csv_field(str(value)))
+            f.write((','.join(values) + '\n').encode('utf-8'))
+
+            if buf.tell() >= EXPORT_BLOCK_SIZE:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        f.close()
+
+        yield buf.getvalue()
+
+    def handle(self, method, path, query, payload, base_url):
+        """Dispatch an emulated API call, returning ``(status, headers, body)``.
+
+        ``body`` is JSON-serializable, except for ``csv_exports`` downloads where it is bytes,
+        or a generator of bytes blocks to send chunked.
+        """
+        parts = [p for p in path.split('/') if p]
+        if parts[:2] == ['api', 'v1']:
+            parts = parts[2:]
+        elif parts and parts[0] == 'csv_exports' and method == 'GET':
+            return self._download(parts[1:])
+        else:
+            return 404, {}, {'errors': ['Not found']}
+
+        fault = self.fault()
+        if fault is not None:
+            return fault
+
+        if not parts:
+            return 404, {}, {'errors': ['Not found']}
+
+        resource, rest = parts[0], parts[1:]
+
+        if resource == 'notifications':
+            return self._notifications(method, rest, query, payload)
+        if resource == 'players':
+            return self._players(method, rest, query, payload, base_url)
+        if resource == 'apps':
+            return self._apps(method, rest, payload)
+
+        return 404, {}, {'errors': ['Not found']}
+
+    def _notifications(self, method, rest, query, payload):
+        if not rest:
+            if method == 'GET':
+                limit = min(int(query.get('limit', 50)), 50)
+                offset = int(query.get('offset', 0))
+                with self._lock:
+                    items = list(self.notifications.values())
+                return 200, {}, {
+                    'total_count': len(items),
+                    'offset': offset,
+                    'limit': limit,
+                    'notifications': items[offset:offset + limit],
+                }
+            if method == 'POST':
+                # like OneSignal, a repeated external_id returns the earlier notification
+                external_id = payload.get('external_id')
+                with self._lock:
+                    existing = self.notifications.get(self.external_ids.get(external_id))
+                if existing is not None:
+                    return 200, {}, {'id': existing['id'], 'recipients': existing['remaining']}
+
+                recipients = len(payload.get('include_player_ids') or []) or self.players
+                notification = {
+                    'id': str(uuid.uuid4()),
+                    'successful': 0,
+                    'failed': 0,
+                    'converted': 0,
+                    'remaining': recipients,
+                    'queued_at': int(time.time()),
+                    'canceled': False,
+                    'external_id': external_id,
+                    'headings': payload.get('headings'),
+                    'contents': payload.get('contents'),
+                    'data': payload.get('data'),
+                }
+                with self._lock:
+                    self.notifications[notification['id']] = notification
+                    if external_id:
+                        self.external_ids[external_id] = notification['id']
+                    if len(self.notifications) > MAX_NOTIFICATIONS:
+                        evicted = self.notifications.popitem(last=False)[1]
+                        self.external_ids.pop(evicted.get('external_id'), None)
+                return 200, {}, {'id': notification['id'], 'recipients': recipients}
+            return 405, {}, {'errors': ['Method not allowed']}
+
+        with self._lock:
+            notification = self.notifications.get(rest[0])
+        if notification is None:
+            return 400, {}, {'errors': ['Could not find notification with id: {}'.format(rest[0])]}
+
+        if method == 'GET':
+            return 200, {}, notification
+        if method == 'PUT':
+            return 200, {}, {'success': True}
+        if method == 'DELETE':
+            notification['canceled'] = True
+            return 200, {}, {'success': True}
+
+        return 405, {}, {'errors': ['Method not allowed']}
+
+    def _players(self, method, rest, query, payload, base_url):
+        if not rest:
+            if method == 'GET':
+                limit = min(int(query.get('limit', MAX_PLAYERS_LIMIT)), MAX_PLAYERS_LIMIT)
+                offset = int(query.get('offset', 0))
+                stop = min(offset + limit, self.players)
+                return 200, {}, {
+                    'total_count': self.players,
+                    'offset': offset,
+                    'limit': limit,
+                    'players': [self.player(i) for i in range(offset, stop)],
+                }
+            if method == 'POST':
+                return 200, {}, {'success': True, 'id': str(uuid.uuid4())}
+            return 405, {}, {'errors': ['Method not allowed']}
+
+        if rest == ['csv_export'] and method == 'POST':
+            export_id = str(uuid.uuid4())
+            with self._lock:
+                self.exports[export_id] = time.time() + self.export_delay
+                while len(self.exports) > MAX_EXPORTS:
+                    self.exports.popitem(last=False)
+            return 200, {}, {
+                'csv_file_url': '{}/csv_exports/{}/users.csv.gz'.format(base_url, export_id),
+            }
+
+        index = self.player_index(rest[0])
+        if index is None:
+            return 400, {}, {'errors': ['No user with this id found']}
+
+        if len(rest) == 1:
+            if method == 'GET':
+                return 200, {}, self.player(index)
+            if method == 'PUT':
+                return 200, {}, {'success': True}
+        elif rest[1] in ('on_session', 'on_purchase', 'on_focus') and method == 'POST':
+            return 200, {}, {'success': True}
+
+        return 405, {}, {'errors': ['Method not allowed']}
+
+    def _apps(self, method, rest, payload):
+        app = {
+            'id': self.app_id,
+            'name': 'Emulated app',
+            'players': self.players,
+            'messagable_players': self.players,
+            'updated_at': '2017-01-29T00:00:00.000Z',
+            'created_at': '2017-01-29T00:00:00.000Z',
+        }
+
+        if not rest:
+            if method == 'GET':
+                return 200, {}, [app]
+            if method == 'POST':
+                app.update(payload, id=str(uuid.uuid4()))
+                return 200, {}, app
+        elif method == 'GET':
+            return 200, {}, dict(app, id=rest[0])
+        elif method == 'PUT':
+            app.update(payload, id=rest[0])
+            return 200, {}, app
+
+        return 405, {}, {'errors': ['Method not allowed']}
+
+    def _download(self, rest):
+        with self._lock:
+            ready_at = self.exports.get(rest[0]) if rest else None
+
+        # OneSignal answers 404 until the export has been written, clients poll for it
+        if ready_at is None or time.time() < ready_at:
+            return 404, {}, b''
+
+        return 200, {'Content-Type': 'application/gzip'}, self.csv_export()
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle would hold the body back on keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _dispatch(self):
+        parsed = urlparse(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(parsed.query).items())
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+
+        if not self.headers.get('Authorization'):
+            status, headers, body = 400, {}, {'errors': ['Please include a case-sensitive header of '
+                                                         'Authorization: Basic <YOUR-REST-API-KEY>']}
+        else:
+            try:
+                if raw and self.headers.get('Content-Encoding') == 'gzip':
+                    raw = gzip_decompress(raw)
+                payload = json.loads(raw.decode('utf-8')) if raw else {}
+            except (ValueError, zlib.error):
+                status, headers, body = 400, {}, {'errors': ['Request body is not valid JSON']}
+            else:
+                base_url = 'http://{}:{}'.format(*self.server.server_address[:2])
+                status, headers, body = self.server.emulator.handle(
+                    self.command, parsed.path, query, payload, base_url)
+
+        if isinstance(body, types.GeneratorType):
+            self._send_chunked(status, headers, body)
+            return
+
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+
+            if len(body) >= GZIP_MIN_SIZE and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                body = gzip_compress(body, 1)
+                headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, status, headers, blocks):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for block in blocks:
+            # an empty chunk would end the body
+            if block:
+                self.wfile.write('{:x}\r\n'.format(len(block)).encode('ascii') + block + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+
+class EmulatorServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server answering requests with an :class:`Emulator`.
+
+    Usage::
+
+      >>> server = EmulatorServer(('127.0.0.1', 0), Emulator(players=10000000))
+      >>> server.start()
+      >>> onesignal = OneSignal(API_KEY, api_base=server.api_base)
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, emulator=None, verbose=False):
+        HTTPServer.__init__(self, address, EmulatorRequestHandler)
+        self.emulator = emulator or Emulator()
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def api_base(self):
+        return 'http://{}:{}/api'.format(*self.server_address[:2])
+
+    def start(self):
+        """Serve from a background daemon thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local OneSignal REST API emulator.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--players', type=int, default=1000000)
+    parser.add_argument('--latency', default='fixed:0',
+                        help='kind:params in seconds, i.e. "lognormal:0.04,0.5" or "uniform:0.01,0.05"')
+    parser.add_argument('--spike-rate', type=float, default=0.0)
+    parser.add_argument('--spike', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--export-delay', type=float, default=2.0)
+    parser.add_argument('--export-rows', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    latency = Latency.from_spec(args.latency, spike_rate=args.spike_rate, spike=args.spike)
+    emulator = Emulator(
+        players=args.players, latency=latency, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        export_delay=args.export_delay, export_rows=args.export_rows, seed=args.seed,
+    )
+    server = EmulatorServer((args.host, args.port), emulator, verbose=args.verbose)
+
+    print('Emulating OneSignal at {}'.format(server.api_base))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
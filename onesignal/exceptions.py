@@ -22,3 +22,27 @@ class OneSignalApiError(Exception):
     @property
     def msg(self):  # pragma: no cover
         return self.args[0]
+
+
+class OneSignalValidationError(OneSignalApiError):
+    """Raised when a payload is rejected locally, before any request is made.
+
+    :attr:`errors` lists every problem found, not only the first.
+
+    """
+    def __init__(self, msg, errors=None):
+        self.errors = errors or [msg]
+
+        super(OneSignalValidationError, self).__init__(msg)
+
+
+class OneSignalRateLimitError(OneSignalApiError):
+    """Raised when a request would wait longer than allowed for a rate limit token.
+
+    :attr:`retry_after` is how long, in seconds, the wait would have been.
+
+    """
+    def __init__(self, msg, retry_after=None):
+        self.retry_after = retry_after
+
+        super(OneSignalRateLimitError, self).__init__(msg, status_code=429)
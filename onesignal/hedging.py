@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.hedging
+~~~~~~~~~~~~~~~~
+
+This module contains request hedging for idempotent GETs.
+
+When a GET has not been answered within a percentile of the recent latency
+of its endpoint, the same request goes out again on another pooled
+connection. The first response that is neither a 5xx nor a 429 is used and
+the other is cancelled: its connection is closed as soon as its headers
+arrive, without reading the body. A budget caps hedges at a fraction of
+requests, so a slow API is not answered with twice the load, and a hedge
+takes a rate limiter token only if one is free right away.
+
+A request that cannot be hedged, because its endpoint has too few latencies
+yet or the budget is spent, is sent from the caller's thread. The others
+are sent from a few threads the policy keeps for reuse.
+
+Usage::
+
+  >>> policy = HedgePolicy(percentile=95, budget=0.05)
+  >>> onesignal = OneSignal(api_key, app_id, hedge_policy=policy)
+  >>> onesignal.devices_details(player_id)
+  >>> policy.stats()
+  {'requests': 1000, 'hedged': 48, 'wins': 31, 'hedge_rate': 0.048, 'win_rate': 0.646}
+
+"""
+
+import threading
+from collections import deque
+
+from .compat import Empty, Queue, timer
+from .exceptions import OneSignalRateLimitError
+
+#: Seconds an attempt thread waits for more work before it exits.
+IDLE_TIMEOUT = 60.0
+
+
+def _usable(response):
+    """Whether a response may win a race; an error the other attempt could avoid may not."""
+    return response.status_code < 500 and response.status_code != 429
+
+
+class _Latencies(object):
+    """Recent latencies of one endpoint, with a cached percentile."""
+    def __init__(self, window, refresh):
+        self.samples = deque(maxlen=window)
+        self.refresh = refresh
+        self.cutoff = None
+        self._pending = 0
+
+    def observe(self, latency, percentile):
+        self.samples.append(latency)
+        self._pending += 1
+        # sorting the window on every request would cost more than it saves
+        if self._pending >= self.refresh:
+            ordered = sorted(self.samples)
+            self.cutoff = ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))]
+            self._pending = 0
+
+
+class _Workers(object):
+    """Daemon threads that run attempts, started only when none is idle."""
+    def __init__(self):
+        self.tasks = Queue()
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def submit(self, func, arg):
+        with self.lock:
+            if self.idle:
+                self.idle -= 1
+                self.tasks.put((func, arg))
+                return
+
+        thread = threading.Thread(target=self._run, args=(func, arg))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, func, arg):
+        while True:
+            func(arg)
+
+            with self.lock:
+                self.idle += 1
+            try:
+                func, arg = self.tasks.get(timeout=IDLE_TIMEOUT)
+            except Empty:
+                with self.lock:
+                    # a task submitted while the wait timed out is taken before exiting
+                    try:
+                        func, arg = self.tasks.get_nowait()
+                    except Empty:
+                        self.idle -= 1
+                        return
+
+
+class HedgePolicy(object):
+    """When and how often :class:`onesignal.OneSignal` hedges GET requests.
+
+    :param percentile: (optional) Hedge a request once it has taken longer than this
+        percentile of the endpoint's recent latency.
+    :param budget: (optional) Most hedges sent, as a fraction of requests, i.e. 0.05 for 5%.
+    :param min_delay: (optional) Never hedge sooner than this, in seconds.
+    :param max_delay: (optional) Never wait longer than this before hedging, in seconds.
+    :param window: (optional) Latencies kept per endpoint.
+    :param min_samples: (optional) Latencies needed before an endpoint is hedged at all.
+    :param endpoints: (optional) Endpoint templates to hedge (i.e. ``players/{id}``),
+        defaults to every GET.
+    :param metrics: (optional) A :class:`onesignal.instrumentation.MetricsCollector` that
+        counts ``hedged_requests_total`` and ``hedge_wins_total`` per endpoint.
+
+    """
+    def __init__(self, percentile=95, budget=0.05, min_delay=0.005, max_delay=1.0, window=1000,
+                 min_samples=20, endpoints=None, metrics=None):
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100.')
+
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.endpoints = frozenset(endpoints) if endpoints is not None else None
+        self.metrics = metrics
+
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+
+        # every request earns ``budget`` of a hedge, up to a small burst
+        self._credit = 0.0
+        self._max_credit = max(1.0, budget * 100)
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._workers = _Workers()
+
+    def __repr__(self):
+        return '<HedgePolicy: p%s, %s budget>' % (self.percentile, self.budget)
+
+    def applies(self, method, endpoint):
+        return method == 'get' and (self.endpoints is None or endpoint in self.endpoints)
+
+    def delay(self, endpoint):
+        """Seconds to wait before hedging a request to ``endpoint``, or None to not hedge it."""
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self._credit + self.budget, self._max_credit)
+            if self._credit < 1:
+                return None
+
+            latencies = self._latencies.get(endpoint)
+            if latencies is None or latencies.cutoff is None:
+                return None
+            if len(latencies.samples) < self.min_samples:
+                return None
+
+            return min(max(latencies.cutoff, self.min_delay), self.max_delay)
+
+    def observe(self, endpoint, latency):
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                refresh = max(1, min(self.min_samples, self.window // 20))
+                latencies = self._latencies[endpoint] = _Latencies(self.window, refresh)
+            latencies.observe(latency, self.percentile)
+
+    def _spend(self, endpoint, rate_limiter=None):
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+
+        if rate_limiter is not None:
+            try:
+                rate_limiter.reserve(endpoint, max_wait=0)
+            except OneSignalRateLimitError:
+                # a hedge is never worth waiting for a token
+                with self._lock:
+                    self._credit += 1
+                return False
+
+        with self._lock:
+            self.hedged += 1
+
+        if self.metrics is not None:
+            self.metrics.incr('hedged_requests_total', endpoint=endpoint)
+
+        return True
+
+    def _won(self, endpoint):
+        with self._lock:
+            self.wins += 1
+
+        if self.metrics is not None:
+            self.metrics.incr('hedge_wins_total', endpoint=endpoint)
+
+    def stats(self):
+        """Requests seen, hedges sent, hedges that answered first, and their rates.
+
+        :rtype: dict
+        """
+        with self._lock:
+            requests, hedged, wins = self.requests, self.hedged, self.wins
+
+        return {
+            'requests': requests,
+            'hedged': hedged,
+            'wins': wins,
+            'hedge_rate': float(hedged) / requests if requests else 0.0,
+            'win_rate': float(wins) / hedged if hedged else 0.0,
+        }
+
+    def send(self, func, url, endpoint, rate_limiter=None, **kwargs):
+        """Make a GET with ``func``, hedging it if it is slow.
+
+        :param func: The ``get`` of a :class:`requests.Session` with room for two
+            connections to the API in its pool.
+        :param rate_limiter: (optional) A :class:`onesignal.ratelimit.SharedRateLimiter` a
+            hedge takes a token from. The first attempt's token is the caller's to take.
+
+        :rtype: ``(response, hedged, hedge won)``
+        """
+        delay = self.delay(endpoint)
+        if delay is None:
+            started = timer()
+            response = func(url, **kwargs)
+            if _usable(response):
+                self.observe(endpoint, timer() - started)
+            return response, False, False
+
+        results = Queue()
+        decided = threading.Event()
+
+        def attempt(n):
+            started = timer()
+            try:
+                response = func(url, stream=True, **kwargs)
+                if decided.is_set():
+                    # lost the race: drop the connection rather than read a body nobody wants
+                    response.close()
+                    return
+                response.content
+            except Exception as e:
+                # raised from the caller's thread if no attempt succeeds
+                results.put((n, None, e))
+                return
+            results.put((n, response, timer() - started))
+
+        self._workers.submit(attempt, 0)
+
+        try:
+            first = results.get(timeout=delay)
+        except Empty:
+            first = None
+
+        hedged = first is None and self._spend(endpoint, rate_limiter)
+        if hedged:
+            self._workers.submit(attempt, 1)
+
+        pending = 2 if hedged else 1
+        error = fallback = None
+        while pending:
+            n, response, outcome = first if first is not None else results.get()
+            first = None
+            pending -= 1
+
+            if response is None:
+                error = error or outcome
+            elif not _usable(response):
+                # returned only if the other attempt does no better
+                fallback = fallback or response
+            else:
+                decided.set()
+                self.observe(endpoint, outcome)
+                if n == 1:
+                    self._won(endpoint)
+
+                return response, hedged, n == 1
+
+        if fallback is not None:
+            return fallback, hedged, False
+
+        raise error
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.instrumentation
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains hooks into the request lifecycle of
+:class:`onesignal.OneSignal`, and collectors built on them for metrics
+(Prometheus text format) and tracing.
+
+Usage::
+
+  >>> instrumentation = Instrumentation()
+  >>> metrics = MetricsCollector()
+  >>> metrics.install(instrumentation)
+  >>> onesignal = OneSignal(API_KEY, APP_ID, instrumentation=instrumentation)
+  >>> onesignal.devices_details('a8c50012-7a78-492a-8a34-6bd3aa2e5f87')
+  >>> print(metrics.to_prometheus())
+
+When no instrumentation is given to the client, none of this runs.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+
+from .compat import timer
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover
+    otel_trace = None
+
+log = logging.getLogger(__name__)
+
+#: Path segments that are part of an endpoint rather than an id.
+ENDPOINT_ACTIONS = frozenset(['csv_export', 'on_session', 'on_purchase', 'on_focus'])
+
+#: Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ('serialize', 'network', 'decode', 'total')
+
+
+def endpoint_template(path):
+    """Collapse ids out of an API path, i.e. ``players/a8c5.../on_session`` to ``players/{id}/on_session``."""
+    path = path.split('?', 1)[0].strip('/')
+    if not path:
+        return path
+
+    parts = path.split('/')
+    for i in range(1, len(parts)):
+        if parts[i] not in ENDPOINT_ACTIONS:
+            parts[i] = '{id}'
+
+    return '/'.join(parts)
+
+
+class RequestEvent(object):
+    """Everything known about one request, passed to every hook.
+
+    Times are in seconds; ``serialize_time``, ``network_time`` and
+    ``decode_time`` are filled in as the request moves through those phases.
+    Sizes are in bytes, ``*_wire_size`` being what went over the network after
+    any gzip ``Content-Encoding``.
+    """
+    __slots__ = (
+        'endpoint', 'method', 'url', 'payload_size', 'wire_size', 'response_size',
+        'response_wire_size', 'status_code', 'error',
+        'started_at', 'serialize_time', 'network_time', 'decode_time', 'extra', '_mark',
+    )
+
+    def __init__(self, endpoint, method, url):
+        self.endpoint = endpoint
+        self.method = method
+        self.url = url
+        self.payload_size = 0
+        self.wire_size = 0
+        self.response_size = 0
+        self.response_wire_size = 0
+        self.status_code = None
+        self.error = None
+        self.started_at = time.time()
+        self.serialize_time = 0.0
+        self.network_time = 0.0
+        self.decode_time = 0.0
+        self.extra = {}
+        self._mark = timer()
+
+    @property
+    def total_time(self):
+        return self.serialize_time + self.network_time + self.decode_time
+
+    def __repr__(self):
+        return '<RequestEvent: %s %s %s>' % (self.method, self.endpoint, self.status_code)
+
+
+class Instrumentation(object):
+    """A set of request lifecycle hooks for :class:`onesignal.OneSignal`.
+
+    Every hook is called with a :class:`RequestEvent`:
+
+    * ``before_request`` once the payload is serialized, just before it is sent.
+    * ``after_response`` once a successful response is decoded.
+    * ``on_error`` when the request fails, with ``event.error`` set. This covers
+      connection errors, rate limit rejections, undecodable responses and API
+      errors.
+
+    A hook that raises is logged and otherwise ignored, instrumentation never
+    breaks a request.
+    """
+    def __init__(self):
+        self.before_request = []
+        self.after_response = []
+        self.on_error = []
+
+    def register(self, before_request=None, after_response=None, on_error=None):
+        """Add hooks, any of which may be omitted."""
+        if before_request is not None:
+            self.before_request.append(before_request)
+        if after_response is not None:
+            self.after_response.append(after_response)
+        if on_error is not None:
+            self.on_error.append(on_error)
+
+    def _call(self, hooks, event):
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception:
+                log.exception('Instrumentation hook %r failed.', hook)
+
+    def start(self, method, url, api_url):
+        path = url[len(api_url):] if url.startswith(api_url) else url
+
+        return RequestEvent(endpoint_template(path), method.upper(), url)
+
+    def throttled(self, event, waited):
+        """Record time spent waiting on a rate limiter, so it isn't counted as serializing."""
+        event.extra['rate_limit_wait'] = waited
+        event._mark += waited
+
+    def sending(self, event, payload_size, wire_size=None):
+        now = timer()
+        event.serialize_time = now - event._mark
+        event._mark = now
+        event.payload_size = payload_size
+        event.wire_size = payload_size if wire_size is None else wire_size
+
+        self._call(self.before_request, event)
+
+    def received(self, event, response):
+        now = timer()
+        event.network_time = now - event._mark
+        event._mark = now
+        event.status_code = response.status_code
+
+        event.response_size = len(response.content)
+        event.response_wire_size = event.response_size
+        if response.headers.get('Content-Encoding') and response.headers.get('Content-Length'):
+            event.response_wire_size = int(response.headers['Content-Length'])
+
+    def finished(self, event):
+        event.decode_time = timer() - event._mark
+
+        self._call(self.after_response, event)
+
+    def failed(self, event, error):
+        if event.status_code is not None:
+            event.decode_time = timer() - event._mark
+        else:
+            event.network_time = timer() - event._mark
+        event.status_code = getattr(error, 'status_code', None) or event.status_code
+        event.error = error
+
+        self._call(self.on_error, event)
+
+
+class Histogram(object):
+    """A cumulative bucket histogram in the Prometheus style."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    """Escape a label value as the Prometheus text format requires."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in sorted(labels.items())) + '}'
+
+
+class MetricsCollector(object):
+    """Per-endpoint request counters and phase latency histograms.
+
+    :param buckets: (optional) Histogram upper bounds in seconds.
+    :param namespace: (optional) Prefix of exported metric names.
+
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, namespace='onesignal'):
+        self.buckets = tuple(buckets)
+        self.namespace = namespace
+
+        self.requests = {}
+        self.errors = {}
+        self.payload_bytes = {}
+        self.bytes_saved = {}
+        self.durations = {}
+        self.counters = {}
+
+        self._lock = threading.Lock()
+
+    def install(self, instrumentation):
+        instrumentation.register(after_response=self.observe, on_error=self.observe)
+
+        return self
+
+    def incr(self, name, value=1, **labels):
+        """Increment a free-form counter, exported as ``<namespace>_<name>``."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, event):
+        key = (event.endpoint, event.method)
+        status = (event.endpoint, event.method, event.status_code or 'none')
+
+        with self._lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            if event.error is not None:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self.payload_bytes[key] = self.payload_bytes.get(key, 0) + event.payload_size
+
+            for direction, saved in (('request', event.payload_size - event.wire_size),
+                                     ('response', event.response_size - event.response_wire_size)):
+                if saved:
+                    saved_key = key + (direction,)
+                    self.bytes_saved[saved_key] = self.bytes_saved.get(saved_key, 0) + saved
+
+            for phase in PHASES:
+                histogram = self.durations.get(key + (phase,))
+                if histogram is None:
+                    histogram = self.durations[key + (phase,)] = Histogram(self.buckets)
+                histogram.observe(getattr(event, phase + '_time'))
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+        ns = self.namespace
+        lines = []
+
+        with self._lock:
+            lines.append('# TYPE {}_requests_total counter'.format(ns))
+            for (endpoint, method, status), value in sorted(self.requests.items(), key=repr):
+                lines.append('{}_requests_total{} {}'.format(
+                    ns, _labels(endpoint=endpoint, method=method, status=status), value))
+
+            lines.append('# TYPE {}_request_errors_total counter'.format(ns))
+            for (endpoint, method), value in sorted(self.errors.items()):
+                lines.append('{}_request_errors_total{} {}'.format(
+                    ns, _labels(endpoint=endpoint, method=method), value))
+
+            lines.append('# TYPE {}_request_payload_bytes_total counter'.format(ns))
+            for (endpoint, method), value in sorted(self.payload_bytes.items()):
+                lines.append('{}_request_payload_bytes_total{} {}'.format(
+                    ns, _labels(endpoint=endpoint, method=method), value))
+
+            lines.append('# TYPE {}_compression_bytes_saved_total counter'.format(ns))
+            for (endpoint, method, direction), value in sorted(self.bytes_saved.items()):
+                lines.append('{}_compression_bytes_saved_total{} {}'.format(
+                    ns, _labels(endpoint=endpoint, method=method, direction=direction), value))
+
+            lines.append('# TYPE {}_request_duration_seconds histogram'.format(ns))
+            for (endpoint, method, phase), h in sorted(self.durations.items()):
+                labels = dict(endpoint=endpoint, method=method, phase=phase)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append('{}_request_duration_seconds_bucket{} {}'.format(
+                        ns, _labels(le=bound, **labels), cumulative))
+                lines.append('{}_request_duration_seconds_sum{} {}'.format(ns, _labels(**labels), h.sum))
+                lines.append('{}_request_duration_seconds_count{} {}'.format(ns, _labels(**labels), h.count))
+
+            names = sorted(set(name for name, _ in self.counters))
+            for name in names:
+                lines.append('# TYPE {}_{} counter'.format(ns, name))
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append('{}_{}{} {}'.format(ns, name, _labels(**dict(labels)), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Span(object):
+    """A finished request span, shaped after OpenTelemetry's."""
+    __slots__ = ('name', 'start_time', 'end_time', 'attributes', 'status', 'error')
+
+    def __init__(self, name, start_time, end_time, attributes, status, error=None):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.attributes = attributes
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return '<Span: %s %s>' % (self.name, self.status)
+
+
+class Tracer(object):
+    """Record one span per request.
+
+    Spans are emitted through OpenTelemetry when a ``tracer`` is given (or
+    ``use_opentelemetry`` is set and ``opentelemetry-api`` is installed), and
+    are otherwise kept as :class:`Span` objects in ``spans`` and passed to
+    ``exporter``.
+
+    :param exporter: (optional) Callable receiving each finished :class:`Span`.
+    :param max_spans: (optional) How many recent spans to keep in ``spans``.
+    :param tracer: (optional) An OpenTelemetry tracer.
+    :param use_opentelemetry: (optional) Use the global OpenTelemetry tracer provider.
+
+    """
+    def __init__(self, exporter=None, max_spans=1000, tracer=None, use_opentelemetry=False):
+        if tracer is None and use_opentelemetry:
+            if otel_trace is None:
+                raise ImportError('use_opentelemetry requires the opentelemetry-api package.')
+            tracer = otel_trace.get_tracer(__name__)
+
+        self.exporter = exporter
+        self.tracer = tracer
+        self.spans = deque(maxlen=max_spans)
+
+    def install(self, instrumentation):
+        instrumentation.register(after_response=self.record, on_error=self.record)
+
+        return self
+
+    def record(self, event):
+        name = 'OneSignal {} {}'.format(event.method, event.endpoint)
+        attributes = {
+            'http.method': event.method,
+            'http.url': event.url,
+            'http.status_code': event.status_code or 0,
+            'onesignal.endpoint': event.endpoint,
+            'onesignal.payload_size': event.payload_size,
+            'onesignal.wire_size': event.wire_size,
+            'onesignal.serialize_time': event.serialize_time,
+            'onesignal.network_time': event.network_time,
+            'onesignal.decode_time': event.decode_time,
+        }
+        end_time = event.started_at + event.total_time
+
+        if self.tracer is not None:
+            span = self.tracer.start_span(name, attributes=attributes,
+                                          start_time=int(event.started_at * 1e9))
+            if event.error is not None:
+                span.record_exception(event.error)
+                span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(event.error)))
+            span.end(end_time=int(end_time * 1e9))
+            return
+
+        span = Span(name, event.started_at, end_time, attributes,
+                    'error' if event.error is not None else 'ok', event.error)
+        self.spans.append(span)
+
+        if self.exporter is not None:
+            self.exporter(span)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.loadtest
+~~~~~~~~~~~~~~~~~
+
+This module contains a load driver that runs :class:`onesignal.OneSignal`
+against an API root (usually :mod:`onesignal.emulator`) and reports
+throughput and tail latency per scenario.
+
+Usage::
+
+  $ python -m onesignal.loadtest --emulate --players 2000000 --concurrency 32 \\
+        --duration 30 --mix notifications_create=5,devices_page=3,devices_details=10
+
+``--emulate`` runs the emulator in a subprocess, so serving requests does not
+compete with the driver for the GIL and skew the latencies it reports.
+
+Scenarios are called with ``(onesignal, options, rng, deadline)``, the deadline
+being a :func:`onesignal.compat.timer` value after which the run ends.
+"""
+
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+from .api import OneSignal
+from .compat import timer
+from .emulator import Emulator, EmulatorServer, Latency
+from .exceptions import OneSignalApiError
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+
+    return sorted_values[index]
+
+
+def scenario_notifications_create(onesignal, options, rng, deadline):
+    player_ids = [str(uuid.UUID(int=(0x5eed << 64) | rng.randrange(options.players)))
+                  for _ in range(options.recipients)]
+
+    return onesignal.notifications_create(
+        include_player_ids=player_ids,
+        contents={'en': 'Load test message'},
+    )
+
+
+def scenario_devices_page(onesignal, options, rng, deadline):
+    offset = rng.randrange(0, max(options.players - 300, 1))
+
+    return onesignal.devices(limit=300, offset=offset)
+
+
+def scenario_devices_details(onesignal, options, rng, deadline):
+    player_id = str(uuid.UUID(int=(0x5eed << 64) | rng.randrange(options.players)))
+
+    return onesignal.devices_details(player_id)
+
+
+def scenario_apps_details(onesignal, options, rng, deadline):
+    return onesignal.apps_details()
+
+
+def scenario_csv_export(onesignal, options, rng, deadline):
+    """Request an export and poll its url until the file is downloadable or the run ends."""
+    url = onesignal.csv_export()['csv_file_url']
+
+    while True:
+        response = onesignal.client.get(url)
+        if response.status_code == 200:
+            return len(response.content)
+        if response.status_code != 404:
+            raise OneSignalApiError('Export download failed.', status_code=response.status_code)
+        if timer() + options.poll_interval >= deadline:
+            raise OneSignalApiError('Export was not ready before the run ended.',
+                                    status_code=response.status_code)
+        time.sleep(options.poll_interval)
+
+
+SCENARIOS = {
+    'notifications_create': scenario_notifications_create,
+    'devices_page': scenario_devices_page,
+    'devices_details': scenario_devices_details,
+    'apps_details': scenario_apps_details,
+    'csv_export': scenario_csv_export,
+}
+
+
+class LoadDriver(object):
+    """Run weighted scenarios from ``concurrency`` threads, each with its own client.
+
+    :param api_base: The API root the clients are pointed at.
+    :param mix: Dict of scenario name to relative weight.
+    :param options: Namespace with ``players``, ``recipients`` and ``poll_interval``.
+    :param concurrency: (optional) Number of worker threads.
+    :param client_kwargs: (optional) Extra keyword arguments for each :class:`onesignal.OneSignal`.
+
+    """
+    def __init__(self, api_base, mix, options, concurrency=8, api_key='load-test', app_id=None,
+                 client_kwargs=None):
+        unknown = set(mix) - set(SCENARIOS)
+        if unknown:
+            raise ValueError('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+        self.api_base = api_base
+        self.mix = mix
+        self.options = options
+        self.concurrency = concurrency
+        self.api_key = api_key
+        self.app_id = app_id or str(uuid.UUID(int=0xa99))
+        self.client_kwargs = client_kwargs or {}
+
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def _worker(self, seed, deadline, remaining):
+        rng = random.Random(seed)
+        onesignal = OneSignal(self.api_key, self.app_id, api_base=self.api_base,
+                              **self.client_kwargs)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        total = float(sum(weights))
+
+        latencies = defaultdict(list)
+        outcomes = defaultdict(lambda: defaultdict(int))
+
+        while timer() < deadline:
+            if remaining is not None:
+                with self._lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+
+            roll = rng.random() * total
+            for name, weight in zip(names, weights):
+                roll -= weight
+                if roll < 0:
+                    break
+
+            start = timer()
+            try:
+                SCENARIOS[name](onesignal, self.options, rng, deadline)
+                outcome = 'ok'
+            except OneSignalApiError as e:
+                outcome = str(e.status_code or 'error')
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            latencies[name].append(timer() - start)
+            outcomes[name][outcome] += 1
+
+        with self._lock:
+            for name, values in latencies.items():
+                self.latencies[name].extend(values)
+            for name, counts in outcomes.items():
+                for outcome, count in counts.items():
+                    self.outcomes[name][outcome] += count
+
+    def run(self, duration=10.0, requests_total=None):
+        """Drive load for ``duration`` seconds or ``requests_total`` calls, whichever ends first.
+
+        :rtype: dict of scenario name to summary
+        """
+        remaining = [requests_total] if requests_total is not None else None
+        start = timer()
+        deadline = start + duration
+
+        threads = [
+            threading.Thread(target=self._worker, args=(i, deadline, remaining))
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return self.summary(timer() - start)
+
+    def summary(self, elapsed):
+        summary = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            summary[name] = {
+                'count': len(values),
+                'throughput': len(values) / elapsed if elapsed else 0.0,
+                'p50': percentile(values, 0.50),
+                'p90': percentile(values, 0.90),
+                'p99': percentile(values, 0.99),
+                'p999': percentile(values, 0.999),
+                'max': values[-1] if values else 0.0,
+                'outcomes': dict(self.outcomes[name]),
+            }
+
+        return summary
+
+
+def format_summary(summary):
+    lines = ['{:<22} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+        'scenario', 'count', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'p999 ms', 'max ms', 'outcomes')]
+    for name in sorted(summary):
+        s = summary[name]
+        outcomes = ' '.join('{}={}'.format(k, v) for k, v in sorted(s['outcomes'].items()))
+        lines.append('{:<22} {:>8} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}  {}'.format(
+            name, s['count'], s['throughput'], s['p50'] * 1000, s['p90'] * 1000,
+            s['p99'] * 1000, s['p999'] * 1000, s['max'] * 1000, outcomes))
+
+    return '\n'.join(lines)
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight or 1)
+
+    return mix
+
+
+def _serve_emulator(emulator_kwargs, ready):
+    """Run an emulator in a subprocess, reporting its API root through ``ready``."""
+    server = EmulatorServer(('127.0.0.1', 0), Emulator(**emulator_kwargs))
+    ready.put(server.api_base)
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load driver for python-onesignal.')
+    parser.add_argument('--api-base', default=None,
+                        help='API root to load, i.e. http://127.0.0.1:8080/api')
+    parser.add_argument('--emulate', action='store_true',
+                        help='Start an emulator subprocess instead of using --api-base')
+    parser.add_argument('--mix', type=parse_mix,
+                        default='notifications_create=1,devices_page=1,devices_details=4,apps_details=1')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--requests', type=int, default=None)
+    parser.add_argument('--players', type=int, default=1000000)
+    parser.add_argument('--recipients', type=int, default=2000,
+                        help='include_player_ids per notifications_create')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--compress-threshold', type=int, default=None,
+                        help='Gzip request bodies of at least this many bytes')
+    parser.add_argument('--latency', default='fixed:0')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    emulator = None
+    api_base = args.api_base
+    if args.emulate or api_base is None:
+        emulator_kwargs = dict(players=args.players, latency=Latency.from_spec(args.latency),
+                               error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                               export_delay=1.0, export_rows=10000)
+        ready = multiprocessing.Queue()
+        emulator = multiprocessing.Process(target=_serve_emulator, args=(emulator_kwargs, ready))
+        emulator.daemon = True
+        emulator.start()
+        api_base = ready.get(timeout=30)
+
+    client_kwargs = {'compress_threshold': args.compress_threshold}
+    driver = LoadDriver(api_base, args.mix, args, concurrency=args.concurrency,
+                        client_kwargs=client_kwargs)
+    try:
+        print(format_summary(driver.run(args.duration, args.requests)))
+    finally:
+        if emulator is not None:
+            emulator.terminate()
+            emulator.join()
+
+
+if __name__ == '__main__':
+    main()
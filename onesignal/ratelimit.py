@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.ratelimit
+~~~~~~~~~~~~~~~~~~
+
+This module contains a rate limiter shared by every process on a host.
+
+Each gunicorn or celery process has its own :class:`onesignal.OneSignal`, so
+no single one of them sees the total request rate. :class:`SharedRateLimiter`
+keeps one token bucket per endpoint in a small memory mapped file that every
+process opens, guarded by an ``flock`` the kernel releases if its holder
+dies.
+
+Buckets are kept as a theoretical arrival time (GCRA), so taking a token is
+one read and one write under the lock. A caller that has to wait reserves
+its token first and then sleeps outside the lock for exactly as long as it
+needs to: waiters are served in the order they asked, and nobody polls.
+
+Usage::
+
+  >>> limiter = SharedRateLimiter('/dev/shm/onesignal.rl', {'notifications': 10},
+  ...                             default=(50, 100))
+  >>> onesignal = OneSignal(api_key, app_id, rate_limiter=limiter)
+
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from .compat import monotonic
+from .exceptions import OneSignalRateLimitError
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_MAGIC = b'OSRL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+# endpoint hash and theoretical arrival time of the next token
+_SLOT = struct.Struct('<Qd')
+
+
+def _parse_limit(limit):
+    """``rate`` or ``(rate, burst)`` to ``(seconds per token, burst tolerance)``."""
+    if isinstance(limit, (tuple, list)):
+        rate, burst = limit
+    else:
+        rate, burst = limit, max(1, int(limit))
+    if rate <= 0 or burst < 1:
+        raise ValueError('A rate limit needs a positive rate and a burst of at least 1.')
+
+    interval = 1.0 / rate
+
+    return interval, interval * (burst - 1)
+
+
+def _slot_key(endpoint):
+    key = struct.unpack('<Q', hashlib.md5(endpoint.encode('utf-8')).digest()[:8])[0]
+
+    return key or 1
+
+
+class SharedRateLimiter(object):
+    """Per-endpoint token buckets shared between processes through a memory mapped file.
+
+    Every process that should share the limits opens the same ``path`` with the same
+    ``limits`` and ``max_wait``; a tmpfs such as ``/dev/shm`` keeps it off disk. POSIX only.
+
+    :param path: The file holding the buckets, created if missing.
+    :param limits: Dict of endpoint template (i.e. ``notifications`` or ``players/{id}``, see
+        :func:`onesignal.instrumentation.endpoint_template`) to requests per second, or to
+        ``(requests per second, burst)``. The burst defaults to one second's worth.
+    :param default: (optional) Limit applied to every other endpoint, each in its own bucket.
+        Other endpoints are not limited when omitted.
+    :param max_wait: (optional) Longest a request waits for a token, in seconds, before
+        :class:`onesignal.OneSignalRateLimitError` is raised instead.
+    :param slots: (optional) Buckets the file has room for, when it is created.
+
+    """
+    def __init__(self, path, limits, default=None, max_wait=60.0, slots=256):
+        if fcntl is None:
+            raise ImportError('SharedRateLimiter requires fcntl, which is only available on POSIX.')
+
+        self.path = path
+        self.limits = dict((endpoint, _parse_limit(limit)) for endpoint, limit in limits.items())
+        self.default = _parse_limit(default) if default is not None else None
+        self.max_wait = max_wait
+        self.slots = slots
+
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._open()
+
+    def __repr__(self):
+        return '<SharedRateLimiter: %s, %d endpoints>' % (self.path, len(self.limits))
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < _HEADER.size:
+                os.ftruncate(fd, _HEADER.size + self.slots * _SLOT.size)
+                mapped = mmap.mmap(fd, 0)
+                _HEADER.pack_into(mapped, 0, _MAGIC, _VERSION, self.slots)
+            else:
+                mapped = mmap.mmap(fd, 0)
+                magic, version, slots = _HEADER.unpack_from(mapped, 0)
+                if magic != _MAGIC or version != _VERSION:
+                    raise ValueError('{} is not a SharedRateLimiter file.'.format(self.path))
+                # whoever created the file decided its size
+                self.slots = slots
+        except Exception:
+            os.close(fd)
+            raise
+        finally:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except (OSError, ValueError):
+                pass
+
+        self._fd = fd
+        self._map = mapped
+        self._pid = os.getpid()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = self._fd = None
+
+    @contextmanager
+    def _locked(self):
+        # a forked child shares the parent's open file, and so its flock: it needs its own
+        if os.getpid() != self._pid:
+            self._lock = threading.Lock()
+            self._open()
+
+        # flock only excludes other processes, threads of this one share it
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot(self, mapped, key):
+        """Offset of the slot for ``key``, claiming a free one if it has none yet."""
+        start = key % self.slots
+        for n in range(self.slots):
+            offset = _HEADER.size + ((start + n) % self.slots) * _SLOT.size
+            found = _SLOT.unpack_from(mapped, offset)[0]
+            if found == key:
+                return offset
+            if found == 0:
+                _SLOT.pack_into(mapped, offset, key, 0.0)
+                return offset
+
+        raise ValueError('{} has no free rate limit slots left.'.format(self.path))
+
+    def limit(self, endpoint):
+        """The ``(seconds per token, burst tolerance)`` of ``endpoint``, or None."""
+        return self.limits.get(endpoint, self.default)
+
+    def reserve(self, endpoint, max_wait=None):
+        """Take a token for ``endpoint`` and return how long to wait before using it.
+
+        :param max_wait: (optional) A shorter ``max_wait`` for this call.
+
+        :rtype: float
+        :raises: :class:`onesignal.OneSignalRateLimitError` when the wait would be longer
+            than ``max_wait``; no token is taken then.
+        """
+        limit = self.limit(endpoint)
+        if limit is None:
+            return 0.0
+
+        interval, tolerance = limit
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        key = _slot_key(endpoint)
+
+        with self._locked() as mapped:
+            offset = self._slot(mapped, key)
+            arrival = _SLOT.unpack_from(mapped, offset)[1]
+            now = monotonic()
+
+            # nothing valid is ever scheduled further ahead than this, so anything else was
+            # left by a holder that died mid-write or comes from before a reboot
+            if not arrival <= now + tolerance + self.max_wait + interval:
+                arrival = now
+
+            start = max(arrival, now)
+            wait = start - tolerance - now
+            if wait > max_wait:
+                raise OneSignalRateLimitError(
+                    'Rate limit of {} would wait {:.3f}s.'.format(endpoint, wait), retry_after=wait)
+
+            _SLOT.pack_into(mapped, offset, key, start + interval)
+
+        return max(wait, 0.0)
+
+    def acquire(self, endpoint, max_wait=None):
+        """Wait for a token for ``endpoint``, returning how long was waited.
+
+        :rtype: float
+        """
+        wait = self.reserve(endpoint, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.recipients
+~~~~~~~~~~~~~~~~~~~
+
+This module contains :class:`RecipientSet`, a compact set of player ids.
+
+Ids are stored as 16-byte binary UUIDs in one sorted buffer, about 16 bytes a
+player against 90+ for a list of strings, so 10M recipients take 160MB. Set
+operations are merges over two sorted buffers, membership is a binary search,
+and chunks encode straight to the JSON ``notifications_create`` expects.
+
+Usage::
+
+  >>> audience = RecipientSet(player_ids) - RecipientSet.load('opted_out.rs')
+  >>> audience -= already_sent
+  >>> for body in audience.payloads({'app_id': APP_ID, 'contents': {'en': 'Hi'}}):
+  ...     onesignal.send_encoded('POST', 'notifications', body)
+
+"""
+
+import binascii
+import heapq
+import json
+import mmap
+import os
+import struct
+import uuid
+
+from .compat import range
+from .validators import MAX_PLAYER_IDS
+
+#: Bytes per packed player id.
+PLAYER_ID_SIZE = 16
+
+#: Ids sorted at a time while building a set; runs are then merged.
+RUN_SIZE = 131072
+
+_MAGIC = b'OSRS'
+_TRAILER = struct.Struct('<4sHQ')
+_VERSION = 1
+
+
+def pack_player_id(player_id):
+    """Pack a player id UUID string into 16 bytes."""
+    return uuid.UUID(player_id).bytes
+
+
+def unpack_player_id(packed):
+    """Inverse of :func:`pack_player_id`."""
+    return str(uuid.UUID(bytes=bytes(packed)))
+
+
+def _items(data):
+    for i in range(0, len(data), PLAYER_ID_SIZE):
+        yield data[i:i + PLAYER_ID_SIZE]
+
+
+def _sorted_run(items):
+    """Sort a list of packed ids and join it without duplicates."""
+    items.sort()
+    previous = None
+    unique = []
+    for item in items:
+        if item != previous:
+            unique.append(item)
+            previous = item
+
+    return b''.join(unique)
+
+
+def _merge_runs(runs):
+    """Merge sorted runs into one sorted buffer without duplicates.
+
+    Ids stream through the merge into a buffer sized for all of them, so only one
+    id per run exists as an object at a time.
+    """
+    if len(runs) == 1:
+        return runs[0]
+
+    out = bytearray(sum(len(run) for run in runs))
+    o = 0
+    previous = None
+    for item in heapq.merge(*[_items(run) for run in runs]):
+        if item != previous:
+            out[o:o + PLAYER_ID_SIZE] = item
+            o += PLAYER_ID_SIZE
+            previous = item
+    del out[o:]
+
+    return bytes(out)
+
+
+def _gallop(data, start, end, key):
+    """Offset of the first id not below ``key`` in ``data[start:end]``.
+
+    Steps double from ``start`` before a binary search, so a run of ``n`` ids is found
+    in about ``2 * log2(n)`` comparisons and a run of one in a single one.
+    """
+    lo, step = start, PLAYER_ID_SIZE
+    while lo < end and data[lo:lo + PLAYER_ID_SIZE] < key:
+        start = lo + PLAYER_ID_SIZE
+        lo += step
+        step *= 2
+
+    hi = min(lo, end) // PLAYER_ID_SIZE
+    lo = start // PLAYER_ID_SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if data[mid * PLAYER_ID_SIZE:(mid + 1) * PLAYER_ID_SIZE] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo * PLAYER_ID_SIZE
+
+
+class RecipientSet(object):
+    """An immutable set of player ids in a sorted 16-byte-per-id buffer.
+
+    :param player_ids: (optional) Player id UUID strings, in any order, duplicates allowed.
+
+    """
+    def __init__(self, player_ids=()):
+        # only RUN_SIZE ids are objects at a time: each run is sorted and packed into one
+        # buffer, and the buffers are merged into another
+        runs = []
+        run = []
+        for player_id in player_ids:
+            run.append(pack_player_id(player_id))
+            if len(run) >= RUN_SIZE:
+                runs.append(_sorted_run(run))
+                run = []
+        if run or not runs:
+            runs.append(_sorted_run(run))
+        del run
+
+        self._data = _merge_runs(runs)
+
+    @classmethod
+    def from_packed(cls, data, is_sorted=False):
+        """Build a set from concatenated 16-byte ids.
+
+        :param is_sorted: (optional) ``data`` is already sorted and unique, so it is used as is.
+        """
+        if len(data) % PLAYER_ID_SIZE:
+            raise ValueError('Packed player ids must be a multiple of 16 bytes.')
+
+        recipients = cls.__new__(cls)
+        if is_sorted:
+            recipients._data = data
+        else:
+            runs = [_sorted_run(list(_items(data[start:start + RUN_SIZE * PLAYER_ID_SIZE])))
+                    for start in range(0, len(data), RUN_SIZE * PLAYER_ID_SIZE)]
+            recipients._data = _merge_runs(runs or [b''])
+
+        return recipients
+
+    @property
+    def packed(self):
+        """The sorted buffer of 16-byte ids."""
+        return self._data
+
+    @property
+    def nbytes(self):
+        return len(self._data)
+
+    def __len__(self):
+        return len(self._data) // PLAYER_ID_SIZE
+
+    def __repr__(self):
+        return '<RecipientSet: %d players>' % len(self)
+
+    def __iter__(self):
+        for item in _items(self._data):
+            yield str(uuid.UUID(bytes=bytes(item)))
+
+    def __eq__(self, other):
+        return isinstance(other, RecipientSet) and self._data[:] == other._data[:]
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def _find(self, packed):
+        """Index of the first id not below ``packed``."""
+        data = self._data
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[mid * PLAYER_ID_SIZE:(mid + 1) * PLAYER_ID_SIZE] < packed:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def __contains__(self, player_id):
+        """Whether ``player_id``, a UUID string or 16 packed bytes, is in the set."""
+        if isinstance(player_id, (bytes, bytearray)) and len(player_id) == PLAYER_ID_SIZE:
+            packed = bytes(player_id)
+        else:
+            try:
+                packed = pack_player_id(player_id)
+            except (TypeError, ValueError):
+                return False
+        i = self._find(packed)
+
+        return self._data[i * PLAYER_ID_SIZE:(i + 1) * PLAYER_ID_SIZE] == packed
+
+    def _probe(self, other, keep):
+        """Ids of ``self`` found (``keep``) or not found in the much larger ``other``.
+
+        Consecutive ids that are kept are copied as one slice.
+        """
+        data, probed = other._data, self._data
+        out = bytearray(len(probed))
+        o = 0
+        run = None
+        for i in range(0, len(probed), PLAYER_ID_SIZE):
+            item = probed[i:i + PLAYER_ID_SIZE]
+            j = other._find(item) * PLAYER_ID_SIZE
+            if (data[j:j + PLAYER_ID_SIZE] == item) == keep:
+                if run is None:
+                    run = i
+            elif run is not None:
+                out[o:o + i - run] = probed[run:i]
+                o += i - run
+                run = None
+        if run is not None:
+            out[o:o + len(probed) - run] = probed[run:]
+            o += len(probed) - run
+        del out[o:]
+
+        return bytes(out)
+
+    def _merge(self, other, take_self, take_both, take_other):
+        """Walk both sorted buffers once, keeping ids according to which side they are on.
+
+        Runs of ids found on one side only are located by galloping and copied as one slice
+        into a buffer sized for the largest possible result.
+        """
+        a, b = self._data, other._data
+        i = j = o = 0
+        na, nb = len(a), len(b)
+        out = bytearray((na if take_self or take_both else 0) + (nb if take_other else 0))
+        while i < na and j < nb:
+            x = a[i:i + PLAYER_ID_SIZE]
+            y = b[j:j + PLAYER_ID_SIZE]
+            if x < y:
+                end = i + PLAYER_ID_SIZE
+                # ids of random UUIDs mostly alternate, so check for a run of one first
+                if end < na and a[end:end + PLAYER_ID_SIZE] < y:
+                    end = _gallop(a, end, na, y)
+                if take_self:
+                    out[o:o + end - i] = a[i:end]
+                    o += end - i
+                i = end
+            elif y < x:
+                end = j + PLAYER_ID_SIZE
+                if end < nb and b[end:end + PLAYER_ID_SIZE] < x:
+                    end = _gallop(b, end, nb, x)
+                if take_other:
+                    out[o:o + end - j] = b[j:end]
+                    o += end - j
+                j = end
+            else:
+                if take_both:
+                    out[o:o + PLAYER_ID_SIZE] = x
+                    o += PLAYER_ID_SIZE
+                i += PLAYER_ID_SIZE
+                j += PLAYER_ID_SIZE
+        if take_self:
+            out[o:o + na - i] = a[i:]
+            o += na - i
+        if take_other:
+            out[o:o + nb - j] = b[j:]
+            o += nb - j
+        del out[o:]
+
+        return RecipientSet.from_packed(bytes(out), is_sorted=True)
+
+    def _cheaper_to_probe(self, other):
+        # m binary searches of log2(n) steps beat walking m + n ids when m is small
+        m, n = len(self), len(other)
+        return m * max(n, 2).bit_length() < m + n
+
+    def union(self, other):
+        return self._merge(other, True, True, True)
+
+    def intersection(self, other):
+        if self._cheaper_to_probe(other):
+            return RecipientSet.from_packed(self._probe(other, True), is_sorted=True)
+        if other._cheaper_to_probe(self):
+            return RecipientSet.from_packed(other._probe(self, True), is_sorted=True)
+
+        return self._merge(other, False, True, False)
+
+    def difference(self, other):
+        if self._cheaper_to_probe(other):
+            return RecipientSet.from_packed(self._probe(other, False), is_sorted=True)
+
+        return self._merge(other, True, False, False)
+
+    def symmetric_difference(self, other):
+        return self._merge(other, True, False, True)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def chunks(self, size=MAX_PLAYER_IDS):
+        """Yield consecutive sub-sets of at most ``size`` ids, sharing this set's buffer."""
+        step = size * PLAYER_ID_SIZE
+        for start in range(0, len(self._data), step):
+            yield RecipientSet.from_packed(self._data[start:start + step], is_sorted=True)
+
+    def json_chunks(self, size=MAX_PLAYER_IDS):
+        """Yield JSON arrays of at most ``size`` player id strings, as bytes.
+
+        The whole chunk is hex encoded at once and split into dashed UUIDs,
+        without making a UUID object per id.
+        """
+        step = size * PLAYER_ID_SIZE
+        for start in range(0, len(self._data), step):
+            hexed = binascii.hexlify(self._data[start:start + step])
+            ids = []
+            for i in range(0, len(hexed), 32):
+                ids.append(b'"' + hexed[i:i + 8] + b'-' + hexed[i + 8:i + 12] + b'-' +
+                           hexed[i + 12:i + 16] + b'-' + hexed[i + 16:i + 20] + b'-' +
+                           hexed[i + 20:i + 32] + b'"')
+            yield b'[' + b','.join(ids) + b']'
+
+    def payloads(self, fields, size=MAX_PLAYER_IDS):
+        """Yield ``notifications_create`` bodies as JSON bytes, one per chunk of ``size`` ids.
+
+        :param fields: The other notification fields, including ``app_id``. They are
+            encoded once; each chunk only splices in its ``include_player_ids``.
+        """
+        head = json.dumps(fields).encode('utf-8')[:-1]
+        separator = b', ' if fields else b''
+        for chunk in self.json_chunks(size):
+            yield head + separator + b'"include_player_ids": ' + chunk + b'}'
+
+    def save(self, path):
+        """Write the set to ``path``, to be opened again with :meth:`load`.
+
+        The ids come first and a small trailer last, so the ids can be mapped at offset 0.
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self._data)
+            f.write(_TRAILER.pack(_MAGIC, _VERSION, len(self)))
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        """Open a set written by :meth:`save`.
+
+        :param use_mmap: (optional) Memory map the file instead of reading it, so opening is
+            instant and only the pages that are touched are read.
+        """
+        with open(path, 'rb') as f:
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            magic, version, count = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError('{} is not a RecipientSet file.'.format(path))
+
+            if not use_mmap or count == 0:
+                f.seek(0)
+                return cls.from_packed(f.read(count * PLAYER_ID_SIZE), is_sorted=True)
+
+            # slicing an mmap returns bytes, so it stands in for the buffer as is
+            mapped = mmap.mmap(f.fileno(), count * PLAYER_ID_SIZE, access=mmap.ACCESS_READ)
+
+        return cls.from_packed(mapped, is_sorted=True)
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""
+onesignal.validators
+~~~~~~~~~~~~~~~~~~~
+
+This module contains per-endpoint payload schemas, compiled once into
+validators so a bad payload is rejected before it costs a request.
+
+Schemas only describe fields the API documents; any other field is passed
+through untouched. A field spec is a dict with:
+
+* ``type``: ``str``, ``int``, ``number``, ``bool``, ``list`` or ``dict``.
+* ``required``: the field must be present.
+* ``choices``: dict of accepted names to the value sent; the values themselves are accepted too,
+  and for ``int`` fields so are numeric strings such as ``'0'``.
+* ``min``: smallest accepted number.
+* ``max_items``: longest accepted list or dict.
+* ``max_bytes``: largest accepted JSON encoding.
+* ``items``: type of list items, or a schema dict for lists of objects.
+* ``values``: type of dict values.
+
+A schema's ``one_of`` lists groups of fields that need at least one non-empty
+member each, i.e. an audience and some content for a notification.
+
+Usage::
+
+  >>> validate('devices_create', {'device_type': 'ios', 'identifier': 'ce77...'})
+  {'device_type': 0, 'identifier': 'ce77...'}
+  >>> valid, errors = validate_many('notifications_create', payloads)
+
+"""
+
+import json
+
+from .compat import basestring, is_py2
+from .exceptions import OneSignalValidationError
+
+#: Device platforms accepted by name for ``device_type``.
+DEVICE_TYPES = {
+    'ios': 0,
+    'android': 1,
+    'amazon': 2,
+    'windowsphone': 3,
+    'chromeapp': 4,
+    'chromeweb': 5,
+    'windows': 6,
+    'safari': 7,
+    'firefox': 8,
+    'macos': 9,
+    'alexa': 10,
+    'email': 11,
+    'huawei': 13,
+    'sms': 14,
+}
+
+#: Most ``include_player_ids`` accepted in one notification.
+MAX_PLAYER_IDS = 2000
+
+#: Largest ``data`` accepted on a notification, in bytes of JSON.
+MAX_DATA_BYTES = 2048
+
+_TYPES = {
+    # bytes would pass here and then fail in json.dumps, so only Python 2 takes both
+    'str': (str,),
+    'int': (int,),
+    'number': (int, float),
+    'bool': (bool,),
+    'list': (list, tuple),
+    'dict': (dict,),
+}
+
+if is_py2:
+    _TYPES['str'] = (basestring,)
+    _TYPES['int'] += (long,)  # noqa
+    _TYPES['number'] += (long,)  # noqa
+
+_DEVICE_FIELDS = {
+    'device_type': {'type': 'int', 'choices': DEVICE_TYPES},
+    'identifier': {'type': 'str'},
+    'language': {'type': 'str'},
+    'timezone': {'type': 'int'},
+    'game_version': {'type': 'str'},
+    'device_model': {'type': 'str'},
+    'device_os': {'type': 'str'},
+    'ad_id': {'type': 'str'},
+    'sdk': {'type': 'str'},
+    'session_count': {'type': 'int', 'min': 0},
+    'tags': {'type': 'dict', 'values': ('str', 'number')},
+    'amount_spent': {'type': 'number', 'min': 0},
+    'created_at': {'type': 'int'},
+    'playtime': {'type': 'int', 'min': 0},
+    'badge_count': {'type': 'int', 'min': 0},
+    'last_active': {'type': 'int'},
+    'notification_types': {'type': 'int'},
+    'test_type': {'type': 'int', 'choices': {'development': 1, 'adhoc': 2}},
+    'long': {'type': 'number'},
+    'lat': {'type': 'number'},
+    'country': {'type': 'str'},
+}
+
+#: Fields that target a notification's recipients; one of them is required.
+AUDIENCE_FIELDS = (
+    'include_player_ids', 'include_subscription_ids', 'include_external_user_ids',
+    'include_aliases', 'include_email_tokens', 'include_phone_numbers', 'include_ios_tokens',
+    'include_android_reg_ids', 'include_amazon_reg_ids', 'include_wp_wns_uris',
+    'include_chrome_reg_ids', 'include_chrome_web_reg_ids', 'included_segments', 'filters',
+)
+
+#: Fields that give a notification something to deliver; one of them is required.
+CONTENT_FIELDS = ('contents', 'template_id', 'content_available', 'email_body')
+
+_NOTIFICATION_FIELDS = {
+    'include_aliases': {'type': 'dict'},
+    'contents': {'type': 'dict', 'values': 'str'},
+    'headings': {'type': 'dict', 'values': 'str'},
+    'subtitle': {'type': 'dict', 'values': 'str'},
+    'template_id': {'type': 'str'},
+    'content_available': {'type': 'bool'},
+    'email_subject': {'type': 'str'},
+    'email_body': {'type': 'str'},
+    'included_segments': {'type': 'list', 'items': 'str'},
+    'excluded_segments': {'type': 'list', 'items': 'str'},
+    'filters': {'type': 'list', 'items': 'dict'},
+    'data': {'type': 'dict', 'max_bytes': MAX_DATA_BYTES},
+    'url': {'type': 'str'},
+    'send_after': {'type': 'str'},
+    'delayed_option': {'type': 'str', 'choices': {'timezone': 'timezone',
+                                                  'last-active': 'last-active'}},
+    'ttl': {'type': 'int', 'min': 0},
+    'priority': {'type': 'int', 'min': 0},
+    'external_id': {'type': 'str'},
+}
+# every other include_* field is a list of ids or tokens
+for _name in AUDIENCE_FIELDS:
+    if _name.startswith('include_'):
+        _NOTIFICATION_FIELDS.setdefault(_name, {'type': 'list', 'items': 'str',
+                                                'max_items': MAX_PLAYER_IDS})
+
+SCHEMAS = {
+    'notifications_create': {
+        'fields': _NOTIFICATION_FIELDS,
+        # a notification needs an audience, and something to show unless it's a template or silent
+        'one_of': [AUDIENCE_FIELDS, CONTENT_FIELDS],
+    },
+    'devices_create': {
+        'fields': dict(_DEVICE_FIELDS, device_type=dict(_DEVICE_FIELDS['device_type'],
+                                                        required=True)),
+    },
+    'devices_update': {
+        'fields': _DEVICE_FIELDS,
+    },
+    'sessions_create': {
+        'fields': dict((k, _DEVICE_FIELDS[k]) for k in (
+            'identifier', 'language', 'timezone', 'game_version', 'device_os', 'ad_id', 'sdk',
+            'tags')),
+    },
+    'purchases_create': {
+        'fields': {
+            'purchases': {'type': 'list', 'required': True, 'items': {
+                'sku': {'type': 'str', 'required': True},
+                'amount': {'type': ('number', 'str'), 'required': True},
+                'iso': {'type': 'str', 'required': True},
+            }},
+            'existing': {'type': 'bool'},
+        },
+    },
+    'sessions_length_update': {
+        'fields': {
+            'state': {'type': 'str', 'required': True},
+            'active_time': {'type': 'int', 'required': True, 'min': 0},
+        },
+    },
+    'apps_create': {
+        'fields': {
+            'name': {'type': 'str', 'required': True},
+        },
+    },
+}
+
+
+def _types(kind):
+    kinds = kind if isinstance(kind, tuple) else (kind,)
+    types = ()
+    for k in kinds:
+        types += _TYPES[k]
+
+    return types, ' or '.join(kinds)
+
+
+def _is(value, types):
+    # bool is an int subclass, but True is not a valid count
+    return isinstance(value, types) and (bool in types or not isinstance(value, bool))
+
+
+def _present(value):
+    """Whether a field counts as given; an empty list, dict or string sends nothing."""
+    if value is None:
+        return False
+    if isinstance(value, (list, tuple, dict) + _TYPES['str']):
+        return len(value) > 0
+
+    return True
+
+
+def _compile_field(name, spec):
+    """Compile one field spec into ``check(payload, errors)``, returning a replacement value
+    when the field was normalized."""
+    types, type_name = _types(spec.get('type', ()))
+    required = spec.get('required', False)
+    choices = spec.get('choices')
+    allowed = frozenset(choices.values()) if choices else None
+    coerce_int = int in types
+    minimum = spec.get('min')
+    max_items = spec.get('max_items')
+    max_bytes = spec.get('max_bytes')
+    items = spec.get('items')
+    values = spec.get('values')
+
+    item_check = item_types = None
+    if isinstance(items, dict):
+        item_check = _compile({'fields': items})
+    elif items is not None:
+        item_types, item_name = _types(items)
+    if values is not None:
+        value_types, value_name = _types(values)
+
+    def check(payload, errors):
+        value = payload.get(name)
+        if value is None:
+            if required:
+                errors.append('{} is required.'.format(name))
+            return None
+
+        if choices is not None and not (_is(value, types) and value in allowed):
+            if isinstance(value, _TYPES['str']) and value.lower() in choices:
+                return choices[value.lower()]
+            if coerce_int and isinstance(value, _TYPES['str']):
+                try:
+                    number = int(value)
+                except ValueError:
+                    pass
+                else:
+                    if number in allowed:
+                        return number
+            errors.append('{} must be one of {}, got {!r}.'.format(
+                name, ', '.join(sorted(choices)), value))
+            return None
+
+        if types and not _is(value, types):
+            errors.append('{} must be {}, got {}.'.format(name, type_name, type(value).__name__))
+            return None
+
+        if minimum is not None and value < minimum:
+            errors.append('{} must be at least {}.'.format(name, minimum))
+        if max_items is not None and len(value) > max_items:
+            errors.append('{} has {} items, at most {} are allowed.'.format(
+                name, len(value), max_items))
+        if max_bytes is not None:
+            try:
+                size = len(json.dumps(value))
+            except (TypeError, ValueError) as e:
+                errors.append('{} is not JSON serializable: {}'.format(name, e))
+            else:
+                if size > max_bytes:
+                    errors.append('{} is larger than {} bytes.'.format(name, max_bytes))
+
+        if item_types is not None:
+            for i, item in enumerate(value):
+                if not _is(item, item_types):
+                    errors.append('{}[{}] must be {}.'.format(name, i, item_name))
+                    break
+        elif item_check is not None:
+            for i, item in enumerate(value):
+                if not isinstance(item, dict):
+                    errors.append('{}[{}] must be dict.'.format(name, i))
+                    continue
+                for error in item_check(item)[1]:
+                    errors.append('{}[{}]: {}'.format(name, i, error))
+
+        if values is not None:
+            for key, item in value.items():
+                if not _is(item, value_types):
+                    errors.append('{}[{!r}] must be {}.'.format(name, key, value_name))
+                    break
+
+        return None
+
+    return check
+
+
+def _compile(schema):
+    """Compile a schema into ``validator(payload) -> (payload, errors)``.
+
+    The returned payload is a copy when a field was normalized, i.e. a
+    ``device_type`` name mapped to its integer.
+    """
+    checks = [(name, _compile_field(name, spec)) for name, spec in schema.get('fields', {}).items()]
+    one_of = schema.get('one_of', ())
+
+    def validator(payload):
+        errors = []
+        replaced = None
+        for name, check in checks:
+            value = check(payload, errors)
+            if value is not None:
+                if replaced is None:
+                    replaced = dict(payload)
+                replaced[name] = value
+
+        for names in one_of:
+            for name in names:
+                if _present(payload.get(name)):
+                    break
+            else:
+                errors.append('One of {} is required.'.format(', '.join(names)))
+
+        return (payload if replaced is None else replaced), errors
+
+    return validator
+
+
+#: Compiled validators, by ``OneSignal`` method name.
+VALIDATORS = dict((endpoint, _compile(schema)) for endpoint, schema in SCHEMAS.items())
+
+
+def validate(endpoint, payload):
+    """Validate and normalize the payload of one ``OneSignal`` method.
+
+    Endpoints without a schema are passed through.
+
+    :param endpoint: A ``OneSignal`` method name, i.e. ``notifications_create``.
+    :param payload: The keyword arguments the method sends.
+
+    :rtype: dict
+    :raises: :class:`onesignal.OneSignalValidationError` listing every problem found.
+    """
+    validator = VALIDATORS.get(endpoint)
+    if validator is None:
+        return payload
+
+    payload, errors = validator(payload)
+    if errors:
+        raise OneSignalValidationError('Invalid {} payload: {}'.format(endpoint, ' '.join(errors)),
+                                       errors)
+
+    return payload
+
+
+def validate_many(endpoint, payloads):
+    """Validate a batch of payloads, keeping the good ones.
+
+    :rtype: ``(valid payloads, [(index, errors), ...])``
+    """
+    validator = VALIDATORS.get(endpoint)
+    if validator is None:
+        return list(payloads), []
+
+    valid = []
+    invalid = []
+    for index, payload in enumerate(payloads):
+        payload, errors = validator(payload)
+        if errors:
+            invalid.append((index, errors))
+        else:
+            valid.append(payload)
+
+    return valid, invalid
@@ -0,0 +1,95 @@
+import uuid
+import unittest
+
+from requests.adapters import HTTPAdapter
+
+from onesignal import OneSignal
+from onesignal.campaign import Campaign, chunk_key
+from onesignal.dedupe import LRUKeyIndex
+from onesignal.emulator import Emulator, EmulatorServer
+from onesignal.recipients import RecipientSet
+
+
+def build_per_language(player_ids, context):
+    half = len(player_ids) // 2
+    return [
+        {'include_player_ids': player_ids[:half], 'contents': {'en': 'Hi'}},
+        {'include_player_ids': player_ids[half:], 'contents': {'fr': 'Salut'}},
+    ]
+
+
+class CampaignTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=1000)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                                   dedupe_index=LRUKeyIndex())
+        self.player_ids = [self.emulator.player_id(i) for i in range(1000)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_sends_every_chunk_once(self):
+        campaign = Campaign(self.onesignal, processes=2, connections=4, chunk_size=100)
+        context = {'contents': {'en': 'Hi'}}
+
+        first = campaign.run(self.player_ids, context, campaign_id='c1')
+        again = campaign.run(RecipientSet(self.player_ids), context, campaign_id='c1')
+
+        self.assertEqual((first['chunks'], first['sent'], first['recipients']), (10, 10, 1000))
+        self.assertEqual((again['chunks'], again['sent'], again['skipped']), (10, 0, 10))
+        self.assertEqual(len(self.emulator.notifications), 10)
+
+    def test_chunks_and_payloads_are_counted_apart(self):
+        campaign = Campaign(self.onesignal, build_per_language, processes=1, chunk_size=500)
+
+        summary = campaign.run(self.player_ids)
+
+        self.assertEqual(summary['chunks'], 2)
+        self.assertEqual(summary['payloads'], 4)
+        self.assertEqual(summary['recipients'], 1000)
+
+    def test_client_adapters_are_left_alone(self):
+        adapter = HTTPAdapter(max_retries=3)
+        self.onesignal.client.mount('http://', adapter)
+
+        campaign = Campaign(self.onesignal, processes=1, connections=4)
+        campaign.run(self.player_ids[:10], {'contents': {'en': 'Hi'}})
+
+        self.assertIs(self.onesignal.client.get_adapter(self.server.api_base), adapter)
+        self.assertEqual(campaign.session().get_adapter(self.server.api_base).max_retries.total, 3)
+
+    def test_chunk_key_is_stable_uuid4(self):
+        self.assertEqual(chunk_key('c', 1), chunk_key('c', 1))
+        self.assertNotEqual(chunk_key('c', 1), chunk_key('c', 2))
+        self.assertEqual(chunk_key('c', 1)[14], '4')
+
+
+def build_invalid_half(player_ids, context):
+    # emulator player ids carry their index in the low bits
+    invalid = (uuid.UUID(player_ids[0]).int & 0xffffffff) % 20 == 0
+    contents = {'en': 1} if invalid else {'en': 'Hi'}
+    return {'contents': contents}
+
+
+class CampaignValidationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=100)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.player_ids = [self.emulator.player_id(i) for i in range(100)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_invalid_payloads_are_not_sent(self):
+        onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base)
+        campaign = Campaign(onesignal, build_invalid_half, processes=1, chunk_size=10)
+
+        summary = campaign.run(self.player_ids)
+
+        # the chunks starting at 0, 20, 40... are invalid
+        self.assertEqual((summary['sent'], summary['invalid']), (5, 5))
+        self.assertEqual(len(self.emulator.notifications), 5)
+        self.assertIn("contents['en'] must be str", summary['errors'][0][1].errors[0])
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from onesignal import columnar
+from onesignal.columnar import ColumnarExport, apply_delta, convert
+
+HEADER = 'id,language,session_count,amount_spent,invalid_identifier\n'
+
+
+class ColumnarTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'players.columnar')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, lines, header=HEADER):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(header + ''.join(line + '\n' for line in lines))
+        return path
+
+    def convert(self):
+        source = self.write('export.csv', ['p1,en,3,1.5,f', 'p2,es,,0,t', 'p3,en,7,,f'])
+        return convert(source, self.path, processes=1)
+
+    def test_convert_and_query(self):
+        export = self.convert()
+
+        self.assertEqual(len(export), 3)
+        self.assertEqual(export.types['session_count'], 'int')
+        self.assertEqual(export.where(language='en'), [0, 2])
+        self.assertEqual(export.where(session_count=lambda v: v > 5), [2])
+        self.assertEqual(export.column('session_count')[1], columnar.NULL_INT)
+        self.assertEqual(list(export.rows(['id', 'invalid_identifier'], where={'language': 'es'})),
+                         [{'id': 'p2', 'invalid_identifier': 1}])
+        export.close()
+
+    def test_apply_delta(self):
+        self.convert().close()
+        delta = self.write('delta.csv', ['p2,fr,9', 'p4,de,1'],
+                           header='id,language,session_count\n')
+
+        export = apply_delta(self.path, delta, processes=2)
+
+        self.assertEqual(len(export), 4)
+        self.assertEqual(list(export.column('id')), ['p1', 'p2', 'p3', 'p4'])
+        self.assertEqual(list(export.column('language')), ['en', 'fr', 'en', 'de'])
+        self.assertEqual(list(export.column('session_count')), [3, 9, 7, 1])
+        # columns missing from the delta keep their values, and are null for new players
+        self.assertEqual(export.column('amount_spent')[0], 1.5)
+        self.assertEqual(export.column('invalid_identifier')[3], -1)
+        self.assertEqual(export.where(language='fr'), [1])
+        self.assertEqual(export.meta['generation'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'c0.col')))
+        export.close()
+
+        again = apply_delta(self.path, delta, processes=1)
+        self.assertEqual(len(again), 4)
+        self.assertEqual(again.files[0], 'c0.2')
+        again.close()
+
+    def test_interrupted_delta_leaves_previous_version(self):
+        self.convert().close()
+        delta = self.write('delta.csv', ['p1,fr,9'], header='id,language,session_count\n')
+
+        original = columnar._write_meta
+
+        def crash(*args, **kwargs):
+            raise KeyboardInterrupt
+
+        columnar._write_meta = crash
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                apply_delta(self.path, delta, processes=1)
+        finally:
+            columnar._write_meta = original
+
+        export = ColumnarExport(self.path)
+        self.assertEqual(list(export.column('language')), ['en', 'es', 'en'])
+        self.assertEqual(export.column('session_count')[0], 3)
+        export.close()
+
+    def test_delta_needs_key_column(self):
+        self.convert().close()
+        delta = self.write('delta.csv', ['fr'], header='language\n')
+
+        with self.assertRaises(ValueError):
+            apply_delta(self.path, delta, processes=1)
+
+    def test_quoted_newlines_across_chunks(self):
+        lines = ['p{},"{}",{},1.5,f'.format(i, 'line1\nline2' if i % 7 == 0 else 'en', i)
+                 for i in range(200)]
+        source = self.write('export.csv', lines)
+
+        export = convert(source, self.path, processes=2, chunk_size=64)
+
+        self.assertEqual(len(export), 200)
+        self.assertEqual(list(export.column('id')), ['p{}'.format(i) for i in range(200)])
+        self.assertEqual(list(export.column('session_count')), list(range(200)))
+        self.assertEqual(export.where(language='line1\nline2'), list(range(0, 200, 7)))
+        export.close()
+
+    def test_late_value_that_does_not_parse(self):
+        lines = ['p{},en,{},0,f'.format(i, i) for i in range(columnar.SAMPLE_ROWS)] + ['px,en,x,0,f']
+        source = self.write('export.csv', lines)
+
+        with self.assertRaises(ValueError) as context:
+            convert(source, self.path, processes=1, chunk_size=1024)
+
+        self.assertIn('session_count', str(context.exception))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_late_bool_that_does_not_parse(self):
+        lines = ['p{},en,1,0,f'.format(i) for i in range(columnar.SAMPLE_ROWS)] + ['px,en,1,0,maybe']
+        source = self.write('export.csv', lines)
+
+        with self.assertRaises(ValueError):
+            convert(source, self.path, processes=1)
+
+    def test_schema_str_keeps_the_value(self):
+        lines = ['p{},en,{},0,f'.format(i, i) for i in range(columnar.SAMPLE_ROWS)] + ['px,en,x,0,f']
+        source = self.write('export.csv', lines)
+
+        export = convert(source, self.path, processes=1, schema={'session_count': 'str'})
+
+        self.assertEqual(export.column('session_count')[-1], 'x')
+        export.close()
+
+    def test_other_versions_are_rejected(self):
+        self.convert().close()
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['version'] = columnar.FORMAT_VERSION + 1
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+        with self.assertRaises(ValueError):
+            ColumnarExport(self.path)
@@ -0,0 +1,130 @@
+import gzip
+import io
+import json
+import os
+import unittest
+
+from onesignal import OneSignal
+from onesignal import compression
+from onesignal.compression import gzip_compress, gzip_decompress
+from onesignal.emulator import Emulator, EmulatorServer
+from onesignal.instrumentation import Instrumentation, MetricsCollector
+
+
+class GzipTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for body in (b'', b'{}', b'{"contents": {"en": "Hi"}}' * 1000, os.urandom(3 * 65536 + 7)):
+            self.assertEqual(gzip_decompress(gzip_compress(body)), body)
+
+    def test_levels(self):
+        body = json.dumps({'include_player_ids': [str(i) for i in range(2000)]}).encode('utf-8')
+
+        fast, small = gzip_compress(body, 1), gzip_compress(body, 9)
+
+        self.assertLess(len(small), len(body))
+        self.assertLessEqual(len(small), len(fast))
+        self.assertEqual(gzip_decompress(fast), body)
+
+    def test_chunks_make_one_stream(self):
+        original = compression.CHUNK_SIZE
+        compression.CHUNK_SIZE = 7
+        try:
+            compressed = gzip_compress(b'abcdefghij' * 10)
+        finally:
+            compression.CHUNK_SIZE = original
+
+        self.assertEqual(gzip_decompress(compressed), b'abcdefghij' * 10)
+
+    def test_readable_by_gzip(self):
+        compressed = gzip_compress(b'hello')
+
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(), b'hello')
+        self.assertEqual(compressed[:2], b'\x1f\x8b')
+
+
+class RequestCompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=1000)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.instrumentation = Instrumentation()
+        self.metrics = MetricsCollector().install(self.instrumentation)
+        self.player_id = self.emulator.player_id(1)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, threshold):
+        onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                              instrumentation=self.instrumentation, compress_threshold=threshold)
+        sent = []
+        post = onesignal.client.post
+
+        def capture(url, **kwargs):
+            sent.append(kwargs)
+            return post(url, **kwargs)
+
+        onesignal.client.post = capture
+        return onesignal, sent
+
+    def notify(self, onesignal, text):
+        return onesignal.notifications_create(include_player_ids=[self.player_id],
+                                              contents={'en': text})
+
+    def test_below_threshold(self):
+        onesignal, sent = self.client(threshold=10000)
+
+        self.notify(onesignal, 'Hi')
+
+        self.assertNotIn('headers', sent[0])
+        self.assertEqual(json.loads(sent[0]['data'])['contents'], {'en': 'Hi'})
+        self.assertEqual(self.metrics.bytes_saved, {})
+
+    def test_at_threshold(self):
+        text = 'Hello again ' * 200
+        onesignal, sent = self.client(threshold=None)
+        self.notify(onesignal, text)
+        size = len(sent[0]['data'])
+
+        onesignal, sent = self.client(threshold=size + 1)
+        self.notify(onesignal, text)
+        self.assertNotIn('headers', sent[0])
+
+        onesignal, sent = self.client(threshold=size)
+        response = self.notify(onesignal, text)
+
+        self.assertEqual(sent[0]['headers'], {'Content-Encoding': 'gzip'})
+        self.assertEqual(len(json.loads(gzip_decompress(sent[0]['data']).decode('utf-8'))
+                             ['contents']['en']), len(text))
+        # the emulator decoded the gzipped body
+        self.assertEqual(self.emulator.notifications[response['id']]['contents'], {'en': text})
+
+        saved = size - len(sent[0]['data'])
+        self.assertGreater(saved, 0)
+        self.assertEqual(self.metrics.bytes_saved, {('notifications', 'POST', 'request'): saved})
+
+    def test_send_encoded(self):
+        onesignal, sent = self.client(threshold=None)
+        body = json.dumps({'app_id': self.emulator.app_id, 'include_player_ids': [self.player_id],
+                           'contents': {'en': 'x' * 5000}}).encode('utf-8')
+
+        response = onesignal.send_encoded('POST', 'notifications', gzip_compress(body),
+                                          content_encoding='gzip', payload_size=len(body))
+
+        self.assertEqual(self.emulator.notifications[response['id']]['contents'], {'en': 'x' * 5000})
+        self.assertEqual(sent[0]['headers'], {'Content-Encoding': 'gzip'})
+        saved = self.metrics.bytes_saved[('notifications', 'POST', 'request')]
+        self.assertEqual(saved, len(body) - len(sent[0]['data']))
+
+    def test_response_bytes_saved(self):
+        onesignal, _ = self.client(threshold=None)
+
+        onesignal.devices(limit=300)
+        onesignal.devices_details(self.player_id)
+
+        # only the page of players is large enough for the emulator to gzip
+        self.assertEqual(list(self.metrics.bytes_saved), [('players', 'GET', 'response')])
+        self.assertGreater(self.metrics.bytes_saved[('players', 'GET', 'response')], 10000)
+        self.assertIn('onesignal_compression_bytes_saved_total'
+                      '{direction="response",endpoint="players",method="GET"}',
+                      self.metrics.to_prometheus())
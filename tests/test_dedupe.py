@@ -0,0 +1,83 @@
+import unittest
+import uuid
+
+from onesignal import OneSignal, OneSignalApiError, OneSignalValidationError
+from onesignal.dedupe import LRUKeyIndex
+from onesignal.emulator import Emulator, EmulatorServer
+
+
+class LRUKeyIndexTestCase(unittest.TestCase):
+    def test_remembers_notification_ids(self):
+        index = LRUKeyIndex()
+        index.add('a', 'n1')
+
+        self.assertIn('a', index)
+        self.assertNotIn('b', index)
+        self.assertEqual(index.notification_id('a'), 'n1')
+
+    def test_evicts_least_recently_added(self):
+        index = LRUKeyIndex(capacity=2)
+        for key in ('a', 'b', 'a', 'c'):
+            index.add(key)
+
+        self.assertNotIn('b', index)
+        self.assertIn('a', index)
+        self.assertIn('c', index)
+
+
+class NotificationsCreateDedupeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=10)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.player_ids = [self.emulator.player_id(0)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, index=None):
+        return OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                         dedupe_index=index)
+
+    def send(self, onesignal, **kwargs):
+        return onesignal.notifications_create(include_player_ids=self.player_ids,
+                                              contents={'en': 'Hi'}, **kwargs)
+
+    def test_index_short_circuits(self):
+        onesignal = self.client(LRUKeyIndex())
+        key = str(uuid.uuid4())
+
+        sent = self.send(onesignal, idempotency_key=key)
+        repeated = self.send(onesignal, idempotency_key=key)
+
+        self.assertEqual(repeated, {'id': sent['id'], 'external_id': key, 'duplicate': True})
+        self.assertEqual(len(self.emulator.notifications), 1)
+
+    def test_failed_send_is_not_recorded(self):
+        index = LRUKeyIndex()
+        key = str(uuid.uuid4())
+        self.emulator.error_rate = 1.0
+
+        with self.assertRaises(OneSignalApiError) as context:
+            self.send(self.client(index), idempotency_key=key)
+
+        self.assertEqual(context.exception.status_code, 500)
+        self.assertNotIn(key, index)
+
+    def test_external_id_is_kept(self):
+        key = str(uuid.uuid4())
+
+        content = self.send(self.client(), external_id=key)
+
+        self.assertEqual(self.emulator.notifications[content['id']]['external_id'], key)
+
+    def test_key_must_be_uuid4(self):
+        with self.assertRaises(OneSignalValidationError):
+            self.send(self.client(), idempotency_key='abc')
+        with self.assertRaises(OneSignalValidationError):
+            self.send(self.client(), idempotency_key=str(uuid.uuid1()))
+
+    def test_conflicting_keys(self):
+        with self.assertRaises(OneSignalValidationError):
+            self.send(self.client(), idempotency_key=str(uuid.uuid4()),
+                      external_id=str(uuid.uuid4()))
@@ -0,0 +1,74 @@
+import argparse
+import csv
+import io
+import unittest
+
+from onesignal import OneSignal, OneSignalApiError
+from onesignal import emulator as emulator_module
+from onesignal.compat import timer
+from onesignal.compression import gzip_decompress
+from onesignal.emulator import Emulator, EmulatorServer
+from onesignal.loadtest import scenario_csv_export
+
+
+class EmulatorExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=50, export_delay=0.0)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_export_is_streamed(self):
+        original = emulator_module.EXPORT_BLOCK_SIZE
+        emulator_module.EXPORT_BLOCK_SIZE = 256
+        try:
+            first = self.onesignal.client.get(self.onesignal.csv_export()['csv_file_url'])
+            second = self.onesignal.client.get(self.onesignal.csv_export()['csv_file_url'])
+        finally:
+            emulator_module.EXPORT_BLOCK_SIZE = original
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(first.content, second.content)
+
+        rows = list(csv.reader(io.StringIO(gzip_decompress(first.content).decode('utf-8'))))
+        self.assertEqual(rows[0], list(emulator_module.CSV_EXPORT_COLUMNS))
+        self.assertEqual(len(rows), 51)
+        self.assertEqual(rows[50][0], self.emulator.player_id(49))
+
+    def test_export_blocks(self):
+        original = emulator_module.EXPORT_BLOCK_SIZE
+        emulator_module.EXPORT_BLOCK_SIZE = 1024
+        try:
+            blocks = list(Emulator(players=500).csv_export(rows=400))
+        finally:
+            emulator_module.EXPORT_BLOCK_SIZE = original
+
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual(len(gzip_decompress(b''.join(blocks)).splitlines()), 401)
+
+    def test_old_exports_are_evicted(self):
+        original = emulator_module.MAX_EXPORTS
+        emulator_module.MAX_EXPORTS = 2
+        try:
+            urls = [self.onesignal.csv_export()['csv_file_url'] for _ in range(3)]
+        finally:
+            emulator_module.MAX_EXPORTS = original
+
+        self.assertEqual(len(self.emulator.exports), 2)
+        self.assertEqual(self.onesignal.client.get(urls[0]).status_code, 404)
+        self.assertEqual(self.onesignal.client.get(urls[2]).status_code, 200)
+
+    def test_csv_export_scenario_stops_at_deadline(self):
+        self.emulator.export_delay = 60.0
+        options = argparse.Namespace(poll_interval=0.05)
+
+        start = timer()
+        with self.assertRaises(OneSignalApiError) as context:
+            scenario_csv_export(self.onesignal, options, None, start + 0.2)
+
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertLess(timer() - start, 1.0)
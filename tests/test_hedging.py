@@ -0,0 +1,166 @@
+import threading
+import time
+import unittest
+
+from onesignal import OneSignalRateLimitError
+from onesignal.hedging import HedgePolicy
+
+ENDPOINT = 'players/{id}'
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, n):
+        self.status_code = status_code
+        self.n = n
+        self.closed = False
+
+    @property
+    def content(self):
+        return b'{}'
+
+    def close(self):
+        self.closed = True
+
+
+class FakeGet(object):
+    """A ``get`` whose n-th call answers ``status_code`` after ``delay`` seconds."""
+    def __init__(self, *attempts):
+        self.attempts = list(attempts)
+        self.calls = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, url, **kwargs):
+        with self.lock:
+            n = len(self.calls)
+            self.calls.append(kwargs)
+            self.threads.add(threading.current_thread())
+            delay, status_code = self.attempts[n % len(self.attempts)]
+        time.sleep(delay)
+        if status_code is None:
+            raise IOError('connection reset')
+        return FakeResponse(status_code, n)
+
+
+class FakeRateLimiter(object):
+    def __init__(self):
+        self.endpoints = []
+
+    def reserve(self, endpoint, max_wait=None):
+        self.endpoints.append((endpoint, max_wait))
+        raise OneSignalRateLimitError('Rate limit of {} would wait 1s.'.format(endpoint), 1.0)
+
+
+class HedgePolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = HedgePolicy(percentile=50, budget=1.0, min_delay=0.05, min_samples=5)
+        for _ in range(5):
+            self.policy.observe(ENDPOINT, 0.01)
+
+    def send(self, get, **kwargs):
+        return self.policy.send(get, 'https://onesignal.com/api/v1/players/1', ENDPOINT, **kwargs)
+
+    def test_not_hedged_without_latencies(self):
+        policy = HedgePolicy(budget=1.0)
+        get = FakeGet((0.0, 200))
+
+        response, hedged, won = policy.send(get, 'url', ENDPOINT)
+
+        self.assertEqual((response.n, hedged, won), (0, False, False))
+        self.assertEqual(get.threads, set([threading.current_thread()]))
+        self.assertEqual(get.calls, [{}])
+
+    def test_not_hedged_without_budget(self):
+        policy = HedgePolicy(percentile=50, budget=0.1, min_samples=5)
+        for _ in range(5):
+            policy.observe(ENDPOINT, 0.01)
+        get = FakeGet((0.0, 200))
+
+        policy.send(get, 'url', ENDPOINT)
+
+        self.assertEqual(get.threads, set([threading.current_thread()]))
+
+    def test_fast_response_is_not_hedged(self):
+        get = FakeGet((0.0, 200))
+
+        response, hedged, won = self.send(get)
+
+        self.assertEqual((response.n, hedged, won), (0, False, False))
+        self.assertEqual(len(get.calls), 1)
+
+    def test_hedge_wins(self):
+        get = FakeGet((0.5, 200), (0.0, 200))
+
+        response, hedged, won = self.send(get)
+
+        self.assertEqual((response.n, hedged, won), (1, True, True))
+        self.assertEqual(self.policy.stats()['wins'], 1)
+
+    def test_server_errors_do_not_win(self):
+        for status_code in (503, 429):
+            get = FakeGet((0.2, 200), (0.0, status_code))
+
+            response, hedged, won = self.send(get)
+
+            self.assertEqual((response.n, response.status_code), (0, 200))
+            self.assertEqual((hedged, won), (True, False))
+
+        self.assertEqual(self.policy.stats()['wins'], 0)
+
+    def test_client_errors_win(self):
+        get = FakeGet((0.5, 200), (0.0, 404))
+
+        response, hedged, won = self.send(get)
+
+        self.assertEqual((response.status_code, won), (404, True))
+
+    def test_bad_response_returned_if_both_are_bad(self):
+        get = FakeGet((0.1, 502), (0.0, None))
+
+        response, hedged, won = self.send(get)
+
+        self.assertEqual((response.status_code, hedged, won), (502, True, False))
+
+    def test_error_raised_if_both_fail(self):
+        get = FakeGet((0.1, None), (0.0, None))
+
+        with self.assertRaises(IOError):
+            self.send(get)
+
+    def test_hedge_needs_a_rate_limit_token(self):
+        get = FakeGet((0.2, 200), (0.0, 200))
+        limiter = FakeRateLimiter()
+
+        response, hedged, won = self.send(get, rate_limiter=limiter)
+
+        self.assertEqual((response.n, hedged, won), (0, False, False))
+        self.assertEqual(limiter.endpoints, [(ENDPOINT, 0)])
+        self.assertEqual(len(get.calls), 1)
+        self.assertEqual(self.policy.stats()['hedged'], 0)
+        # the budget spent on the rejected hedge is given back
+        self.assertGreaterEqual(self.policy._credit, 1)
+
+    def test_threads_are_reused(self):
+        get = FakeGet((0.08, 200), (0.0, 200))
+
+        for _ in range(6):
+            self.assertTrue(self.send(get)[1])
+        time.sleep(0.2)
+
+        self.assertEqual(len(get.calls), 12)
+        self.assertLessEqual(len(get.threads), 3)
+        self.assertNotIn(threading.current_thread(), get.threads)
+
+    def test_budget(self):
+        policy = HedgePolicy(percentile=50, budget=0.25, min_delay=0.01, max_delay=0.01,
+                             min_samples=5)
+        for _ in range(5):
+            policy.observe(ENDPOINT, 0.001)
+        get = FakeGet((0.05, 200))
+
+        for _ in range(8):
+            policy.send(get, 'url', ENDPOINT)
+
+        stats = policy.stats()
+        self.assertEqual(stats['requests'], 8)
+        self.assertEqual(stats['hedged'], 2)
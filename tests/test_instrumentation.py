@@ -0,0 +1,205 @@
+import socket
+import unittest
+
+import requests
+
+from onesignal import OneSignal, OneSignalApiError
+from onesignal.emulator import Emulator, EmulatorServer, Latency
+from onesignal.instrumentation import (Instrumentation, MetricsCollector, RequestEvent, Tracer,
+                                       endpoint_template)
+
+
+class EndpointTemplateTestCase(unittest.TestCase):
+    def test_ids_are_collapsed(self):
+        self.assertEqual(endpoint_template('players/a8c50012-7a78-492a-8a34-6bd3aa2e5f87'),
+                         'players/{id}')
+        self.assertEqual(endpoint_template('/notifications/abc?app_id=1'), 'notifications/{id}')
+
+    def test_actions_are_kept(self):
+        self.assertEqual(endpoint_template('players/a8c50012-7a78-492a-8a34-6bd3aa2e5f87/on_session'),
+                         'players/{id}/on_session')
+        self.assertEqual(endpoint_template('players/csv_export?app_id=1'), 'players/csv_export')
+
+    def test_collections(self):
+        self.assertEqual(endpoint_template('notifications'), 'notifications')
+        self.assertEqual(endpoint_template(''), '')
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=10, latency=Latency('fixed', (0.05,)))
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.instrumentation = Instrumentation()
+        self.onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                                   instrumentation=self.instrumentation)
+        self.player_id = self.emulator.player_id(1)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def record(self):
+        calls = []
+        self.instrumentation.register(
+            before_request=lambda event: calls.append(('before_request', event)),
+            after_response=lambda event: calls.append(('after_response', event)),
+            on_error=lambda event: calls.append(('on_error', event)))
+        return calls
+
+    def test_hooks_and_phases(self):
+        calls = self.record()
+
+        self.onesignal.devices_details(self.player_id)
+
+        self.assertEqual([name for name, _ in calls], ['before_request', 'after_response'])
+        event = calls[0][1]
+        self.assertIs(calls[1][1], event)
+        self.assertEqual((event.method, event.endpoint, event.status_code), ('GET', 'players/{id}', 200))
+        self.assertGreaterEqual(event.network_time, 0.05)
+        self.assertLess(event.serialize_time, 0.05)
+        self.assertLess(event.decode_time, 0.05)
+        self.assertAlmostEqual(event.total_time,
+                               event.serialize_time + event.network_time + event.decode_time)
+        self.assertGreater(event.response_size, 0)
+        self.assertIsNone(event.error)
+
+    def test_payload_size(self):
+        calls = self.record()
+
+        self.onesignal.devices_create('android', identifier='abc')
+
+        event = calls[0][1]
+        self.assertEqual(event.endpoint, 'players')
+        self.assertEqual(event.payload_size, event.wire_size)
+        self.assertGreater(event.payload_size, len('{"device_type": 1}'))
+
+    def test_api_error(self):
+        calls = self.record()
+
+        with self.assertRaises(OneSignalApiError):
+            self.onesignal.devices_details(self.emulator.player_id(99))
+
+        self.assertEqual([name for name, _ in calls], ['before_request', 'on_error'])
+        event = calls[1][1]
+        self.assertEqual(event.status_code, 400)
+        self.assertIsInstance(event.error, OneSignalApiError)
+        self.assertGreaterEqual(event.network_time, 0.05)
+
+    def test_raising_hook_does_not_break_the_request(self):
+        def broken(event):
+            raise RuntimeError('broken hook')
+
+        self.instrumentation.register(before_request=broken, after_response=broken)
+        calls = self.record()
+
+        self.assertEqual(self.onesignal.devices_details(self.player_id)['id'], self.player_id)
+        self.assertEqual([name for name, _ in calls], ['before_request', 'after_response'])
+
+    def test_tracer_spans(self):
+        spans = []
+        tracer = Tracer(exporter=spans.append).install(self.instrumentation)
+
+        self.onesignal.devices_details(self.player_id)
+        with self.assertRaises(OneSignalApiError):
+            self.onesignal.devices_details(self.emulator.player_id(99))
+
+        self.assertEqual(list(tracer.spans), spans)
+        ok, error = spans
+        self.assertEqual((ok.name, ok.status, ok.error), ('OneSignal GET players/{id}', 'ok', None))
+        self.assertEqual(ok.attributes['http.status_code'], 200)
+        self.assertGreaterEqual(ok.end_time - ok.start_time, 0.05)
+        self.assertEqual(error.status, 'error')
+        self.assertIsInstance(error.error, OneSignalApiError)
+        self.assertEqual(error.attributes['http.status_code'], 400)
+
+    def test_connection_error_span(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        spans = []
+        Tracer(exporter=spans.append).install(self.instrumentation)
+        onesignal = OneSignal('key', self.emulator.app_id,
+                              api_base='http://127.0.0.1:{}/api'.format(port),
+                              instrumentation=self.instrumentation)
+
+        with self.assertRaises(requests.ConnectionError):
+            onesignal.devices_details(self.player_id)
+
+        self.assertEqual(spans[0].status, 'error')
+        self.assertEqual(spans[0].attributes['http.status_code'], 0)
+        self.assertIsInstance(spans[0].error, requests.ConnectionError)
+
+    def test_metrics_from_requests(self):
+        metrics = MetricsCollector().install(self.instrumentation)
+
+        self.onesignal.devices_details(self.player_id)
+        with self.assertRaises(OneSignalApiError):
+            self.onesignal.devices_details(self.emulator.player_id(99))
+
+        self.assertEqual(metrics.requests, {('players/{id}', 'GET', 200): 1,
+                                            ('players/{id}', 'GET', 400): 1})
+        self.assertEqual(metrics.errors, {('players/{id}', 'GET'): 1})
+        self.assertEqual(metrics.durations[('players/{id}', 'GET', 'network')].count, 2)
+
+
+def event(endpoint, method, status_code, serialize, network, decode, error=None,
+          payload_size=0, wire_size=0):
+    event = RequestEvent(endpoint, method, 'https://onesignal.com/api/v1/' + endpoint)
+    event.status_code = status_code
+    event.serialize_time, event.network_time, event.decode_time = serialize, network, decode
+    event.payload_size, event.wire_size = payload_size, wire_size
+    event.error = error
+    return event
+
+
+class PrometheusTestCase(unittest.TestCase):
+    def test_text_format(self):
+        metrics = MetricsCollector(buckets=(0.25, 1.0))
+        metrics.observe(event('players/{id}', 'GET', 200, 0.25, 0.5, 0.125))
+        metrics.observe(event('notifications', 'POST', 400, 0.0, 2.0, 0.0,
+                              error=OneSignalApiError('bad', 400), payload_size=100, wire_size=40))
+        metrics.incr('hedged_requests_total', endpoint='a"b\\c\nd')
+
+        self.assertEqual(metrics.to_prometheus(), '\n'.join([
+            '# TYPE onesignal_requests_total counter',
+            'onesignal_requests_total{endpoint="notifications",method="POST",status="400"} 1',
+            'onesignal_requests_total{endpoint="players/{id}",method="GET",status="200"} 1',
+            '# TYPE onesignal_request_errors_total counter',
+            'onesignal_request_errors_total{endpoint="notifications",method="POST"} 1',
+            '# TYPE onesignal_request_payload_bytes_total counter',
+            'onesignal_request_payload_bytes_total{endpoint="notifications",method="POST"} 100',
+            'onesignal_request_payload_bytes_total{endpoint="players/{id}",method="GET"} 0',
+            '# TYPE onesignal_compression_bytes_saved_total counter',
+            'onesignal_compression_bytes_saved_total'
+            '{direction="request",endpoint="notifications",method="POST"} 60',
+            '# TYPE onesignal_request_duration_seconds histogram',
+        ] + histogram('notifications', 'POST', 'decode', (1, 1, 1), 0.0)
+          + histogram('notifications', 'POST', 'network', (0, 0, 1), 2.0)
+          + histogram('notifications', 'POST', 'serialize', (1, 1, 1), 0.0)
+          + histogram('notifications', 'POST', 'total', (0, 0, 1), 2.0)
+          + histogram('players/{id}', 'GET', 'decode', (1, 1, 1), 0.125)
+          + histogram('players/{id}', 'GET', 'network', (0, 1, 1), 0.5)
+          + histogram('players/{id}', 'GET', 'serialize', (1, 1, 1), 0.25)
+          + histogram('players/{id}', 'GET', 'total', (0, 1, 1), 0.875)
+          + [
+            '# TYPE onesignal_hedged_requests_total counter',
+            'onesignal_hedged_requests_total{endpoint="a\\"b\\\\c\\nd"} 1',
+        ]) + '\n')
+
+    def test_namespace(self):
+        metrics = MetricsCollector(namespace='push')
+        metrics.incr('sent', 2)
+        metrics.incr('sent')
+
+        self.assertIn('# TYPE push_sent counter\npush_sent{} 3\n', metrics.to_prometheus())
+
+
+def histogram(endpoint, method, phase, cumulative, total):
+    name = 'onesignal_request_duration_seconds'
+    labels = 'method="' + method + '",phase="' + phase + '"'
+    lines = [name + '_bucket{endpoint="' + endpoint + '",le="' + le + '",' + labels + '} ' +
+             str(count) for le, count in zip(('0.25', '1.0', '+Inf'), cumulative)]
+    labels = 'endpoint="' + endpoint + '",' + labels
+    return lines + [name + '_sum{' + labels + '} ' + str(total),
+                    name + '_count{' + labels + '} 1']
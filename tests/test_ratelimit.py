@@ -0,0 +1,126 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from onesignal import OneSignal, OneSignalRateLimitError
+from onesignal.compat import monotonic
+from onesignal.emulator import Emulator, EmulatorServer
+from onesignal.instrumentation import Instrumentation
+from onesignal.ratelimit import _SLOT, SharedRateLimiter, _slot_key
+
+
+def take_tokens(path, count, results):
+    limiter = SharedRateLimiter(path, {'notifications': (50, 1)})
+    first = monotonic()
+    for _ in range(count):
+        limiter.acquire('notifications')
+    results.put((first, monotonic()))
+
+
+class SharedRateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'onesignal.rl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_processes_share_the_rate(self):
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=take_tokens, args=(self.path, 25, results))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        spans = [results.get(timeout=10) for _ in processes]
+        for process in processes:
+            process.join()
+
+        # 100 tokens at 50/s without a burst: the last one is 99 intervals after the first
+        elapsed = max(last for first, last in spans) - min(first for first, last in spans)
+        self.assertGreater(elapsed, 1.9)
+        self.assertLess(elapsed, 2.3)
+
+    def test_burst(self):
+        limiter = SharedRateLimiter(self.path, {'notifications': (10, 3)})
+
+        waits = [limiter.reserve('notifications') for _ in range(4)]
+
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.1, delta=0.02)
+
+    def test_max_wait_rejects_without_taking_a_token(self):
+        limiter = SharedRateLimiter(self.path, {'notifications': (1, 1)}, max_wait=0.5)
+        limiter.reserve('notifications')
+
+        for _ in range(2):
+            with self.assertRaises(OneSignalRateLimitError) as context:
+                limiter.reserve('notifications')
+            self.assertEqual(context.exception.status_code, 429)
+            self.assertAlmostEqual(context.exception.retry_after, 1.0, delta=0.05)
+
+        with self.assertRaises(OneSignalRateLimitError):
+            limiter.acquire('notifications', max_wait=0)
+
+    def test_unlimited_endpoints(self):
+        limiter = SharedRateLimiter(self.path, {'notifications': 1})
+
+        self.assertEqual([limiter.reserve('players') for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_stale_slot_is_reset(self):
+        limiter = SharedRateLimiter(self.path, {'notifications': (1, 1)}, max_wait=0.5)
+        key = _slot_key('notifications')
+
+        for arrival in (monotonic() + 1e9, float('nan')):
+            with limiter._locked() as mapped:
+                _SLOT.pack_into(mapped, limiter._slot(mapped, key), key, arrival)
+
+            self.assertEqual(limiter.reserve('notifications'), 0.0)
+
+            with limiter._locked() as mapped:
+                arrival = _SLOT.unpack_from(mapped, limiter._slot(mapped, key))[1]
+            self.assertFalse(math.isnan(arrival))
+            self.assertLess(arrival, monotonic() + 1.1)
+
+    def test_file_is_shared_and_checked(self):
+        SharedRateLimiter(self.path, {}, slots=16).close()
+        self.assertEqual(SharedRateLimiter(self.path, {}, slots=256).slots, 16)
+
+        other = os.path.join(self.directory, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            SharedRateLimiter(other, {})
+
+
+class RateLimitedClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.emulator = Emulator(players=10)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_rejection_reaches_on_error(self):
+        errors = []
+        instrumentation = Instrumentation()
+        instrumentation.register(on_error=errors.append)
+        limiter = SharedRateLimiter(os.path.join(self.directory, 'onesignal.rl'), {},
+                                    default=(1, 1), max_wait=0)
+        onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                              instrumentation=instrumentation, rate_limiter=limiter)
+        player_id = self.emulator.player_id(1)
+
+        onesignal.devices_details(player_id)
+        with self.assertRaises(OneSignalRateLimitError):
+            onesignal.devices_details(player_id)
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].endpoint, 'players/{id}')
+        self.assertEqual(errors[0].status_code, 429)
+        self.assertIsInstance(errors[0].error, OneSignalRateLimitError)
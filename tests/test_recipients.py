@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from onesignal import recipients as recipients_module
+from onesignal import validators
+from onesignal.recipients import RecipientSet, pack_player_id
+
+
+def player_id(n):
+    return str(uuid.UUID(int=n))
+
+
+class RecipientSetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.evens = RecipientSet(player_id(n) for n in range(0, 100, 2))
+        self.thirds = RecipientSet(player_id(n) for n in range(0, 100, 3))
+
+    def assertIds(self, recipients, numbers):
+        self.assertEqual(list(recipients), [player_id(n) for n in sorted(numbers)])
+
+    def test_sorted_and_unique(self):
+        recipients = RecipientSet([player_id(3), player_id(1), player_id(3), player_id(2)])
+
+        self.assertEqual(len(recipients), 3)
+        self.assertIds(recipients, [1, 2, 3])
+        self.assertEqual(recipients.nbytes, 48)
+
+    def test_runs_are_merged(self):
+        original = recipients_module.RUN_SIZE
+        recipients_module.RUN_SIZE = 7
+        try:
+            recipients = RecipientSet(player_id(n % 40) for n in range(100, 0, -1))
+            packed = RecipientSet.from_packed(b''.join(pack_player_id(player_id(n % 40))
+                                                       for n in range(100)))
+        finally:
+            recipients_module.RUN_SIZE = original
+
+        self.assertIds(recipients, range(40))
+        self.assertEqual(packed, recipients)
+
+    def test_empty(self):
+        self.assertEqual(len(RecipientSet()), 0)
+        self.assertEqual(RecipientSet() | self.evens, self.evens)
+        self.assertEqual(len(self.evens & RecipientSet()), 0)
+
+    def test_contains(self):
+        self.assertIn(player_id(4), self.evens)
+        self.assertIn(pack_player_id(player_id(4)), self.evens)
+        self.assertNotIn(player_id(5), self.evens)
+        self.assertNotIn(player_id(1000), self.evens)
+
+    def test_contains_only_takes_bytes_as_packed(self):
+        self.assertIn(bytearray(pack_player_id(player_id(4))), self.evens)
+        self.assertNotIn('0123456789abcdef', self.evens)
+        self.assertNotIn('not a player id', self.evens)
+        self.assertNotIn(b'short', self.evens)
+
+    def test_max_player_ids_is_shared(self):
+        self.assertIs(recipients_module.MAX_PLAYER_IDS, validators.MAX_PLAYER_IDS)
+        self.assertEqual([len(chunk) for chunk in RecipientSet(
+            player_id(n) for n in range(validators.MAX_PLAYER_IDS + 1)).chunks()],
+            [validators.MAX_PLAYER_IDS, 1])
+
+    def test_set_operations(self):
+        evens, thirds = set(range(0, 100, 2)), set(range(0, 100, 3))
+
+        self.assertIds(self.evens | self.thirds, evens | thirds)
+        self.assertIds(self.evens & self.thirds, evens & thirds)
+        self.assertIds(self.evens - self.thirds, evens - thirds)
+        self.assertIds(self.thirds - self.evens, thirds - evens)
+        self.assertIds(self.evens ^ self.thirds, evens ^ thirds)
+
+    def test_set_operations_on_runs(self):
+        low = RecipientSet(player_id(n) for n in range(0, 600))
+        high = RecipientSet(player_id(n) for n in range(400, 1000))
+
+        self.assertIds(low | high, range(1000))
+        self.assertIds(low & high, range(400, 600))
+        self.assertIds(low - high, range(400))
+        self.assertIds(low ^ high, list(range(400)) + list(range(600, 1000)))
+
+    def test_probe(self):
+        few = RecipientSet(player_id(n) for n in (2, 3, 4, 5, 6, 200))
+        many = RecipientSet(player_id(n) for n in range(0, 1000, 2))
+        self.assertTrue(few._cheaper_to_probe(many))
+
+        self.assertIds(few & many, [2, 4, 6, 200])
+        self.assertIds(many & few, [2, 4, 6, 200])
+        self.assertIds(few - many, [3, 5])
+
+    def test_equality(self):
+        self.assertEqual(self.evens, RecipientSet(reversed(list(self.evens))))
+        self.assertNotEqual(self.evens, self.thirds)
+        self.assertNotEqual(self.evens, set(self.evens))
+
+    def test_chunks(self):
+        chunks = list(self.evens.chunks(20))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [20, 20, 10])
+        self.assertEqual(sum((list(chunk) for chunk in chunks), []), list(self.evens))
+
+    def test_payloads(self):
+        fields = {'app_id': 'app', 'contents': {'en': 'Hi'}}
+        bodies = list(self.evens.payloads(fields, size=20))
+
+        payloads = [json.loads(body.decode('utf-8')) for body in bodies]
+        self.assertEqual(len(payloads), 3)
+        self.assertEqual(payloads[0]['contents'], {'en': 'Hi'})
+        self.assertEqual(sum((p['include_player_ids'] for p in payloads), []), list(self.evens))
+
+    def test_payloads_without_fields(self):
+        body = next(RecipientSet([player_id(1)]).payloads({}))
+
+        self.assertEqual(json.loads(body.decode('utf-8')), {'include_player_ids': [player_id(1)]})
+
+
+class RecipientSetFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'audience.rs')
+        self.recipients = RecipientSet(player_id(n) for n in range(0, 100, 2))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        self.recipients.save(self.path)
+
+        for use_mmap in (True, False):
+            loaded = RecipientSet.load(self.path, use_mmap=use_mmap)
+            self.assertEqual(loaded, self.recipients)
+            self.assertIn(player_id(10), loaded)
+            self.assertEqual(list(loaded - RecipientSet([player_id(0)]))[0], player_id(2))
+
+    def test_save_and_load_empty(self):
+        RecipientSet().save(self.path)
+
+        self.assertEqual(len(RecipientSet.load(self.path)), 0)
+
+    def test_load_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+
+        with self.assertRaises(ValueError):
+            RecipientSet.load(self.path)
@@ -0,0 +1,175 @@
+import unittest
+
+from onesignal import OneSignal, OneSignalApiError, OneSignalValidationError
+from onesignal.emulator import Emulator, EmulatorServer
+from onesignal.validators import validate, validate_many
+
+
+class NotificationSchemaTestCase(unittest.TestCase):
+    def assertValid(self, payload):
+        self.assertEqual(validate('notifications_create', payload), payload)
+
+    def assertInvalid(self, payload, message):
+        with self.assertRaises(OneSignalValidationError) as context:
+            validate('notifications_create', payload)
+        self.assertTrue(any(message in error for error in context.exception.errors),
+                        context.exception.errors)
+
+    def test_player_ids(self):
+        self.assertValid({'include_player_ids': ['a'], 'contents': {'en': 'Hi'}})
+
+    def test_external_user_ids(self):
+        self.assertValid({'include_external_user_ids': ['u1'], 'contents': {'en': 'Hi'}})
+
+    def test_email(self):
+        self.assertValid({'include_email_tokens': ['a@example.com'], 'email_subject': 'Hi',
+                          'email_body': '<p>Hi</p>'})
+
+    def test_sms(self):
+        self.assertValid({'include_phone_numbers': ['+15555550100'], 'contents': {'en': 'Hi'}})
+
+    def test_aliases(self):
+        self.assertValid({'include_aliases': {'external_id': ['u1']}, 'template_id': 't'})
+
+    def test_push_tokens(self):
+        for field in ('include_chrome_reg_ids', 'include_chrome_web_reg_ids',
+                      'include_amazon_reg_ids', 'include_wp_wns_uris'):
+            self.assertValid({field: ['token'], 'content_available': True})
+
+    def test_segments_and_filters(self):
+        self.assertValid({'included_segments': ['All'], 'contents': {'en': 'Hi'}})
+        self.assertValid({'filters': [{'field': 'tag'}], 'contents': {'en': 'Hi'}})
+
+    def test_unknown_fields_pass_through(self):
+        self.assertValid({'included_segments': ['All'], 'contents': {'en': 'Hi'},
+                          'ios_badgeType': 'Increase'})
+
+    def test_audience_required(self):
+        self.assertInvalid({'contents': {'en': 'Hi'}}, 'include_external_user_ids')
+
+    def test_content_required(self):
+        self.assertInvalid({'included_segments': ['All']}, 'email_body')
+
+    def test_empty_audience_is_missing(self):
+        for audience in ({'include_player_ids': []}, {'include_aliases': {}},
+                         {'included_segments': []}, {'include_player_ids': [], 'filters': []}):
+            payload = dict(audience, contents={'en': 'Hi'})
+            self.assertInvalid(payload, 'One of include_player_ids')
+
+    def test_empty_content_is_missing(self):
+        self.assertInvalid({'included_segments': ['All'], 'contents': {}}, 'One of contents')
+        self.assertInvalid({'included_segments': ['All'], 'template_id': ''}, 'One of contents')
+
+    def test_bytes_are_not_strings(self):
+        self.assertInvalid({'include_player_ids': [b'a'], 'contents': {'en': 'Hi'}},
+                           'include_player_ids[0] must be str')
+        self.assertInvalid({'include_player_ids': ['a'], 'contents': {'en': b'x'}},
+                           "contents['en'] must be str")
+
+    def test_data_must_be_serializable(self):
+        self.assertInvalid({'included_segments': ['All'], 'contents': {'en': 'Hi'},
+                            'data': {'when': object()}}, 'data is not JSON serializable')
+
+    def test_types(self):
+        self.assertInvalid({'included_segments': ['All'], 'contents': {'en': 1}},
+                           "contents['en'] must be str")
+        self.assertInvalid({'include_player_ids': 'a', 'contents': {'en': 'Hi'}},
+                           'include_player_ids must be list')
+        self.assertInvalid({'included_segments': ['All'], 'contents': {'en': 'Hi'}, 'ttl': -1},
+                           'ttl must be at least 0')
+
+    def test_limits(self):
+        self.assertInvalid({'include_player_ids': ['a'] * 2001, 'contents': {'en': 'Hi'}},
+                           'at most 2000')
+        self.assertInvalid({'included_segments': ['All'], 'contents': {'en': 'Hi'},
+                            'data': {'blob': 'x' * 3000}}, 'larger than 2048 bytes')
+
+    def test_every_error_is_reported(self):
+        with self.assertRaises(OneSignalValidationError) as context:
+            validate('notifications_create', {'ttl': 'x'})
+        self.assertEqual(len(context.exception.errors), 3)
+
+
+class DeviceSchemaTestCase(unittest.TestCase):
+    def test_device_type_names(self):
+        self.assertEqual(validate('devices_create', {'device_type': 'iOS'}), {'device_type': 0})
+        self.assertEqual(validate('devices_create', {'device_type': 'sms'}), {'device_type': 14})
+
+    def test_device_type_numbers(self):
+        self.assertEqual(validate('devices_create', {'device_type': 1}), {'device_type': 1})
+        self.assertEqual(validate('devices_create', {'device_type': '0'}), {'device_type': 0})
+
+    def test_device_type_invalid(self):
+        for value in ('ps5', '12', b'0', b'ios', True, None):
+            with self.assertRaises(OneSignalValidationError):
+                validate('devices_create', {'device_type': value})
+
+    def test_unknown_endpoint_passes_through(self):
+        payload = {'anything': object()}
+        self.assertIs(validate('devices_delete', payload), payload)
+
+
+class ValidateManyTestCase(unittest.TestCase):
+    def test_splits_valid_and_invalid(self):
+        payloads = [
+            {'device_type': 'android'},
+            {'device_type': 'nope'},
+            {'identifier': 'x'},
+        ]
+
+        valid, invalid = validate_many('devices_create', payloads)
+
+        self.assertEqual(valid, [{'device_type': 1}])
+        self.assertEqual([index for index, errors in invalid], [1, 2])
+        self.assertIn('device_type is required.', invalid[1][1])
+
+    def test_unknown_endpoint(self):
+        self.assertEqual(validate_many('apps', [{'a': 1}]), ([{'a': 1}], []))
+
+
+class ClientValidationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator(players=10)
+        self.server = EmulatorServer(('127.0.0.1', 0), self.emulator)
+        self.server.start()
+        self.onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base)
+        self.player_id = self.emulator.player_id(1)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_devices_create_sends_device_type(self):
+        sent = []
+        original = self.onesignal._send
+
+        def capture(method, url, event, payload_size, wire_size, **kwargs):
+            sent.append(kwargs['data'])
+            return original(method, url, event, payload_size, wire_size, **kwargs)
+
+        self.onesignal._send = capture
+        self.assertTrue(self.onesignal.devices_create('0', identifier='abc')['success'])
+        self.assertTrue(self.onesignal.devices_create('android')['success'])
+
+        self.assertIn('"device_type": 0', sent[0])
+        self.assertIn('"device_type": 1', sent[1])
+
+    def test_devices_create_rejects_unknown_type(self):
+        with self.assertRaises(OneSignalApiError):
+            self.onesignal.devices_create('console')
+
+    def test_purchases_create(self):
+        purchase = {'sku': 'gems', 'amount': '1.99', 'iso': 'USD'}
+        self.assertTrue(self.onesignal.purchases_create(self.player_id, [purchase])['success'])
+
+        with self.assertRaises(OneSignalApiError) as context:
+            self.onesignal.purchases_create(self.player_id, [{'sku': 'gems', 'amount': 1.99}])
+        self.assertEqual(context.exception.errors, ['purchases[0]: iso is required.'])
+
+    def test_purchases_create_requires_purchases(self):
+        with self.assertRaises(OneSignalValidationError):
+            self.onesignal.purchases_create(self.player_id, [{'sku': 1}])
+
+    def test_validation_can_be_turned_off(self):
+        onesignal = OneSignal('key', self.emulator.app_id, api_base=self.server.api_base,
+                              validate_payloads=False)
+        self.assertTrue(onesignal.devices_create('console')['success'])